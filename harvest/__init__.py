@@ -1,24 +1,189 @@
 #!/usr/bin/env python3
 
+import asyncio
+import urllib.parse
+from collections import deque
+from collections.abc import Iterator, Mapping
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from typing import Any
 
-from rest import http_request
+from rest import aio, http_request, set_rate_limit
+
+HARVEST_API = "https://api.harvestapp.com/v2"
+# Harvest allows 100 requests per 15 seconds per access token
+RATE_LIMIT_REQUESTS = 100
+RATE_LIMIT_PERIOD = 15.0
+MAX_WORKERS = 4
+
+
+set_rate_limit(
+    "api.harvestapp.com",
+    RATE_LIMIT_REQUESTS,
+    RATE_LIMIT_PERIOD,
+    per_header="Authorization",
+)
+
+
+def _page_url(url: str, page: int) -> str:
+    parsed = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parsed.query))
+    query["page"] = str(page)
+    return parsed._replace(query=urllib.parse.urlencode(query)).geturl()
+
+
+def _time_entries_url(
+    from_date: int | str | None,
+    to_date: int | str | None,
+    updated_since: str | None,
+    filters: Mapping[str, int] | None,
+) -> str:
+    query: dict[str, Any] = {}
+    # no bounds when only asking for changes, see EntryStore.sync
+    if from_date is not None:
+        query["from"] = from_date
+    if to_date is not None:
+        query["to"] = to_date
+    if updated_since is not None:
+        query["updated_since"] = updated_since
+    # i.e. user_id / client_id / project_id, see harvest.ids.resolve_filters
+    query.update(filters or {})
+    return f"{HARVEST_API}/time_entries?{urllib.parse.urlencode(query)}"
+
+
+def iter_time_entries(
+    account_id: str,
+    access_token: str,
+    from_date: int | str | None,
+    to_date: int | str | None,
+    max_workers: int = MAX_WORKERS,
+    updated_since: str | None = None,
+    filters: Mapping[str, int] | None = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    Yield time entries page by page as they arrive.
+
+    At most `max_workers` pages are downloaded ahead of the consumer, so memory
+    stays bounded while processing overlaps with the network.
+    """
+    headers = {
+        "Authorization": f"Bearer {access_token}",
+        "Harvest-Account-id": account_id,
+    }
+
+    def fetch(url: str) -> dict[str, Any]:
+        return http_request(url, headers=headers)
+
+    url = _time_entries_url(from_date, to_date, updated_since, filters)
+    resp = fetch(url)
+    total_pages = resp.get("total_pages")
+    next_url = resp["links"]["next"]
+    yield from resp["time_entries"]
+
+    page_based = next_url is not None and "page=" in next_url
+    if max_workers > 1 and page_based and total_pages:
+        # Page numbers are known upfront, so fetch the rest concurrently,
+        # keeping a window of in-flight pages and yielding them in page order.
+        urls = (_page_url(url, page) for page in range(2, total_pages + 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = deque(pool.submit(fetch, u) for u in islice(urls, max_workers))
+            while pending:
+                page = pending.popleft().result()
+                for u in islice(urls, 1):
+                    pending.append(pool.submit(fetch, u))
+                yield from page["time_entries"]
+        return
+
+    while next_url is not None:
+        resp = fetch(next_url)
+        next_url = resp["links"]["next"]
+        yield from resp["time_entries"]
 
 
 def get_time_entries(
-    account_id: str, access_token: str, from_date: int, to_date: int
+    account_id: str,
+    access_token: str,
+    from_date: int | str,
+    to_date: int | str,
+    max_workers: int = MAX_WORKERS,
+    updated_since: str | None = None,
+    filters: Mapping[str, int] | None = None,
+) -> list[dict[str, Any]]:
+    return list(
+        iter_time_entries(
+            account_id,
+            access_token,
+            from_date,
+            to_date,
+            max_workers,
+            updated_since,
+            filters,
+        )
+    )
+
+
+def iter_time_entries_for_ranges(
+    account_id: str,
+    access_token: str,
+    ranges: list[tuple[str, str]],
+    max_workers: int = MAX_WORKERS,
+    filters: Mapping[str, int] | None = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    Download several date ranges concurrently and yield their entries newest
+    range first, the same order a single query over all of them returns.
+    """
+    with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+        futures = [
+            pool.submit(
+                get_time_entries,
+                account_id,
+                access_token,
+                start,
+                end,
+                max_workers,
+                filters=filters,
+            )
+            for start, end in sorted(ranges, reverse=True)
+        ]
+        for future in futures:
+            yield from future.result()
+
+
+async def get_time_entries_async(
+    account_id: str,
+    access_token: str,
+    from_date: int,
+    to_date: int,
+    max_workers: int = MAX_WORKERS,
+    updated_since: str | None = None,
+    filters: Mapping[str, int] | None = None,
 ) -> list[dict[str, Any]]:
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Harvest-Account-id": account_id,
     }
-    url = f"https://api.harvestapp.com/v2/time_entries?from={from_date}&to={to_date}"
-    entries = []
-    while url is not None:
-        resp = http_request(
-            url,
-            headers=headers,
-        )
+    url = _time_entries_url(from_date, to_date, updated_since, filters)
+    resp = await aio.http_request(url, headers=headers)
+    entries = list(resp["time_entries"])
+    total_pages = resp.get("total_pages")
+    next_url = resp["links"]["next"]
+
+    if next_url is not None and "page=" in next_url and total_pages:
+        semaphore = asyncio.Semaphore(max_workers)
+
+        async def fetch(page: int) -> list[dict[str, Any]]:
+            async with semaphore:
+                resp = await aio.http_request(_page_url(url, page), headers=headers)
+                return resp["time_entries"]
+
+        pages = await asyncio.gather(*(fetch(p) for p in range(2, total_pages + 1)))
+        for page in pages:
+            entries.extend(page)
+        return entries
+
+    while next_url is not None:
+        resp = await aio.http_request(next_url, headers=headers)
         entries.extend(resp["time_entries"])
-        url = resp["links"]["next"]
+        next_url = resp["links"]["next"]
     return entries
@@ -0,0 +1,150 @@
+import json
+import os
+import tempfile
+import time
+import urllib.error
+from pathlib import Path
+from typing import Any
+
+from rest import http_request
+
+from . import HARVEST_API
+
+# names rarely change, but new users/clients/projects show up; those are
+# picked up immediately since a cache miss always refreshes the listing
+MAX_AGE = 24 * 60 * 60
+
+CACHE_PATH = Path(
+    os.environ.get(
+        "HARVEST_ID_CACHE",
+        Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+        / "harvest-exporter"
+        / "ids.json",
+    )
+)
+
+
+def _display_name(kind: str, obj: dict[str, Any]) -> str:
+    if kind == "users":
+        # matches entry["user"]["name"] of time entries
+        return f"{obj['first_name']} {obj['last_name']}".strip()
+    return obj["name"]
+
+
+class IdCache:
+    """
+    Maps user, client and project names of a Harvest account to their ids.
+
+    The listings are kept in a JSON file for MAX_AGE seconds, so resolving a
+    filter usually costs no request at all.
+    """
+
+    def __init__(
+        self, account_id: str, access_token: str, path: Path = CACHE_PATH
+    ) -> None:
+        self.account_id = account_id
+        self.access_token = access_token
+        self.path = path
+
+    def _load(self) -> dict[str, Any]:
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, data: dict[str, Any]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # replace atomically, so that concurrent processes never read a
+        # half written file
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        Path(tmp).replace(self.path)
+
+    def _fetch(self, kind: str) -> dict[str, list[int]]:
+        headers = {
+            "Authorization": f"Bearer {self.access_token}",
+            "Harvest-Account-id": self.account_id,
+        }
+        ids: dict[str, list[int]] = {}
+        url: str | None = f"{HARVEST_API}/{kind}?per_page=2000"
+        while url is not None:
+            resp = http_request(url, headers=headers)
+            for obj in resp[kind]:
+                ids.setdefault(_display_name(kind, obj), []).append(obj["id"])
+            url = resp["links"]["next"]
+        return ids
+
+    def lookup(self, kind: str, name: str) -> list[int]:
+        """
+        Return the ids of all `kind` ("users", "clients" or "projects") with
+        this name, or an empty list if there is none or we may not list them.
+        """
+        data = self._load()
+        cached = data.get(self.account_id, {}).get(kind)
+        if (
+            cached is not None
+            and time.time() - cached["fetched_at"] < MAX_AGE
+            and name in cached["ids"]
+        ):
+            return cached["ids"][name]
+        try:
+            ids = self._fetch(kind)
+        except urllib.error.HTTPError as e:
+            # listing users needs administrator or manager permissions
+            if e.code == 403:
+                return []
+            raise
+        # re-read, another process may have updated other listings meanwhile
+        data = self._load()
+        data.setdefault(self.account_id, {})[kind] = dict(
+            fetched_at=time.time(), ids=ids
+        )
+        self._save(data)
+        return ids.get(name, [])
+
+    def unique(self, kind: str, name: str) -> int | None:
+        """The id for name, or None if it is unknown or ambiguous."""
+        ids = self.lookup(kind, name)
+        return ids[0] if len(ids) == 1 else None
+
+
+def resolve_filters(
+    account_id: str,
+    access_token: str,
+    *,
+    user: str | None = None,
+    client: str | None = None,
+    project: str | None = None,
+    agency: bool = True,
+) -> dict[str, int]:
+    """
+    Translate names into user_id / client_id / project_id query parameters
+    for /v2/time_entries.
+
+    Like harvest-exporter's --client, `client` matches the client name, or the
+    project name of external clients; without an agency every client is
+    external, so it only matches project names.
+
+    Names that are unknown or shared by several objects (i.e. the same project
+    name for two clients) are left out, callers still have to filter the
+    entries by name; this only reduces what is downloaded.
+    """
+    cache = IdCache(account_id, access_token)
+    filters = {}
+    if user is not None:
+        user_id = cache.unique("users", user)
+        if user_id is not None:
+            filters["user_id"] = user_id
+    if client is not None:
+        client_ids = cache.lookup("clients", client) if agency else []
+        project_ids = cache.lookup("projects", client)
+        if len(client_ids) == 1 and not project_ids:
+            filters["client_id"] = client_ids[0]
+        elif len(project_ids) == 1 and not client_ids:
+            filters["project_id"] = project_ids[0]
+    if project is not None:
+        project_id = cache.unique("projects", project)
+        if project_id is not None:
+            filters["project_id"] = project_id
+    return filters
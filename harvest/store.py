@@ -0,0 +1,186 @@
+import json
+import sqlite3
+from collections.abc import Iterable
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from . import MAX_WORKERS, iter_time_entries
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS time_entries (
+    account_id TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    spent_date TEXT NOT NULL,
+    user_name TEXT NOT NULL,
+    client_name TEXT NOT NULL,
+    project_name TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    entry TEXT NOT NULL,
+    PRIMARY KEY (account_id, id)
+);
+CREATE INDEX IF NOT EXISTS time_entries_spent_date
+    ON time_entries (account_id, spent_date);
+CREATE INDEX IF NOT EXISTS time_entries_user
+    ON time_entries (account_id, user_name, spent_date);
+CREATE INDEX IF NOT EXISTS time_entries_client
+    ON time_entries (account_id, client_name, spent_date);
+CREATE INDEX IF NOT EXISTS time_entries_project
+    ON time_entries (account_id, project_name, spent_date);
+CREATE TABLE IF NOT EXISTS synced_ranges (
+    account_id TEXT NOT NULL,
+    from_date TEXT NOT NULL,
+    to_date TEXT NOT NULL,
+    synced_at TEXT NOT NULL,
+    PRIMARY KEY (account_id, from_date, to_date)
+);
+"""
+
+
+def iso_date(d: int | str) -> str:
+    """Normalize 20220101 / "20220101" / "2022-01-01" to 2022-01-01."""
+    s = str(d).replace("-", "")
+    return f"{s[:4]}-{s[4:6]}-{s[6:8]}"
+
+
+class EntryStore:
+    """
+    Local copy of Harvest time entries.
+
+    The first sync of a date range downloads it completely, later syncs only
+    ask Harvest for entries changed since the previous sync (`updated_since`).
+    Harvest does not report deleted entries this way, so pass `full=True`
+    to sync() to rebuild a range from scratch.
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def _covering_range(
+        self, account_id: str, from_date: str, to_date: str
+    ) -> tuple[str, str, str] | None:
+        return self.db.execute(
+            "SELECT from_date, to_date, synced_at FROM synced_ranges "
+            "WHERE account_id = ? AND from_date <= ? AND to_date >= ? "
+            "ORDER BY synced_at DESC LIMIT 1",
+            (account_id, from_date, to_date),
+        ).fetchone()
+
+    def _upsert(self, account_id: str, entries: Iterable[dict[str, Any]]) -> int:
+        before = self.db.total_changes
+        self.db.executemany(
+            "INSERT OR REPLACE INTO time_entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    account_id,
+                    entry["id"],
+                    entry["spent_date"],
+                    entry["user"]["name"],
+                    entry["client"]["name"],
+                    entry["project"]["name"],
+                    entry["updated_at"],
+                    json.dumps(entry),
+                )
+                for entry in entries
+            ),
+        )
+        return self.db.total_changes - before
+
+    def sync(
+        self,
+        account_id: str,
+        access_token: str,
+        from_date: int | str,
+        to_date: int | str,
+        full: bool = False,
+        max_workers: int = MAX_WORKERS,
+    ) -> int:
+        """Bring the store up to date for the range, returns the number of fetched entries."""
+        start, end = iso_date(from_date), iso_date(to_date)
+        synced_at = datetime.now(UTC).strftime("%Y-%m-%dT%H:%M:%SZ")
+        covering = None if full else self._covering_range(account_id, start, end)
+        # download before opening the write transaction, so that other
+        # processes using the store are not locked out for its duration
+        if covering is None:
+            entries = list(
+                iter_time_entries(
+                    account_id, access_token, from_date, to_date, max_workers
+                )
+            )
+        else:
+            start, end, updated_since = covering
+            # without date bounds, so that entries moved out of (or into) the
+            # range are updated too; rows are replaced by id
+            entries = list(
+                iter_time_entries(
+                    account_id,
+                    access_token,
+                    None,
+                    None,
+                    max_workers,
+                    updated_since=updated_since,
+                )
+            )
+        with self.db:
+            if covering is None:
+                self.db.execute(
+                    "DELETE FROM time_entries "
+                    "WHERE account_id = ? AND spent_date BETWEEN ? AND ?",
+                    (account_id, start, end),
+                )
+            fetched = self._upsert(account_id, entries)
+            self.db.execute(
+                "INSERT OR REPLACE INTO synced_ranges VALUES (?, ?, ?, ?)",
+                (account_id, start, end, synced_at),
+            )
+        return fetched
+
+    def query(
+        self,
+        account_id: str,
+        from_date: int | str,
+        to_date: int | str,
+        user: str | None = None,
+        client: str | None = None,
+        project: str | None = None,
+    ) -> list[dict[str, Any]]:
+        sql = (
+            "SELECT entry FROM time_entries "
+            "WHERE account_id = ? AND spent_date BETWEEN ? AND ?"
+        )
+        params = [account_id, iso_date(from_date), iso_date(to_date)]
+        for column, value in (
+            ("user_name", user),
+            ("client_name", client),
+            ("project_name", project),
+        ):
+            if value is not None:
+                sql += f" AND {column} = ?"
+                params.append(value)
+        # same order as the Harvest API returns them
+        sql += " ORDER BY spent_date DESC, id DESC"
+        return [json.loads(row[0]) for row in self.db.execute(sql, params)]
+
+
+def get_time_entries_cached(
+    store_path: Path,
+    account_id: str,
+    access_token: str,
+    from_date: int | str,
+    to_date: int | str,
+    full_sync: bool = False,
+    max_workers: int = MAX_WORKERS,
+    user: str | None = None,
+    project: str | None = None,
+) -> list[dict[str, Any]]:
+    store = EntryStore(store_path)
+    try:
+        store.sync(account_id, access_token, from_date, to_date, full_sync, max_workers)
+        return store.query(account_id, from_date, to_date, user=user, project=project)
+    finally:
+        store.close()
@@ -1,40 +1,55 @@
 #!/usr/bin/env python3
 
 import sys
-from collections import OrderedDict, defaultdict
-from dataclasses import dataclass
+from collections import Counter, defaultdict
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from fractions import Fraction
 from typing import Any
 
-from .transferwise import exchange_rate
+from .fixed import Fixed
+from .transferwise import DailyRates, exchange_rate
 
 
 def convert_currency(
-    amount: Fraction, source_currency: str, target_currency: str
+    amount: Fixed, source_currency: str, target_currency: str
 ) -> Fraction:
+    # exact, converted amounts are only rounded once, to cents on export
     rate = exchange_rate(source_currency, target_currency)
-    return amount * rate
+    return amount.as_fraction() * rate
 
 
-@dataclass
+@dataclass(slots=True)
 class Task:
     name: str = ""
     client: str = ""
-    # Use fractions here to avoid rounding errors, round to cents once on export
-    rounded_hours: Fraction = Fraction(0)
-    cost: Fraction = Fraction(0)
-    hourly_rate: Fraction = Fraction(0)
+    # Use fixed point decimals here to avoid rounding errors, round to cents once on export
+    rounded_hours: Fixed = field(default_factory=Fixed)
+    cost: Fixed = field(default_factory=Fixed)
+    hourly_rate: Fixed = field(default_factory=Fixed)
     currency: str = ""
     is_external: bool = False
+    # Harvest account id, only set when several accounts are merged
+    account: str = ""
+    # with DailyRates, the cost converted entry by entry at the rate of its day,
+    # exact like convert_currency
+    target_currency: str = ""
+    target_cost: Fraction = field(default_factory=Fraction)
 
     def exchange_rate(self, currency: str) -> Fraction:
+        if currency == self.target_currency and self.cost:
+            # average of the daily rates, weighted by cost
+            return self.target_cost / self.cost.as_fraction()
         return exchange_rate(self.currency, currency)
 
     def converted_cost(self, currency: str) -> Fraction:
+        if currency == self.target_currency:
+            return self.target_cost
         return convert_currency(self.cost, self.currency, currency)
 
     def converted_hourly_rate(self, currency: str) -> Fraction:
-        return convert_currency(self.hourly_rate, self.currency, currency)
+        return self.hourly_rate.as_fraction() * self.exchange_rate(currency)
 
     @property
     def agency(self) -> str:
@@ -44,29 +59,72 @@ class Task:
 
 
 class Client:
-    def __init__(self) -> None:
-        self.tasks: dict[str, Task] = defaultdict(Task)
-
-    def sort(self) -> None:
-        self.tasks = OrderedDict(sorted(self.tasks.items()))
-
+    __slots__ = ("tasks",)
 
-class User:
     def __init__(self) -> None:
-        self.clients: dict[str, Client] = defaultdict(Client)
+        self.tasks: dict[str, Task] = {}
 
-    def sort(self) -> None:
-        self.clients = OrderedDict(sorted(self.clients.items()))
-        for client in self.clients.values():
-            client.sort()
 
+class User:
+    __slots__ = ("clients",)
 
-def process_entry(
+    def __init__(self) -> None:
+        self.clients: dict[str, Client] = {}
+
+
+# (user, client, task) names, interned so that all entries share one copy
+TaskKey = tuple[str, str, str]
+
+
+def group_tasks(tasks: dict[TaskKey, Task]) -> dict[str, User]:
+    """Sort the flat task index once and nest it as users -> clients -> tasks."""
+    users: dict[str, User] = {}
+    for key in sorted(tasks):
+        user_name, client_name, task_name = key
+        user = users.get(user_name)
+        if user is None:
+            user = users[user_name] = User()
+        client = user.clients.get(client_name)
+        if client is None:
+            client = user.clients[client_name] = Client()
+        client.tasks[task_name] = tasks[key]
+    return users
+
+
+def merge_accounts(accounts: dict[str, dict[str, User]]) -> dict[str, User]:
+    """
+    Merge the users of several Harvest accounts into one tree, tagging every
+    task with its account id. Tasks with the same user, client and name in
+    more than one account are kept apart by appending the account id to their
+    key in the tree; Task.name, which is exported, stays the same.
+    """
+    tasks: dict[TaskKey, Task] = {}
+    seen: Counter[TaskKey] = Counter()
+    for users in accounts.values():
+        for user_name, user in users.items():
+            for client_name, client in user.clients.items():
+                seen.update((user_name, client_name, name) for name in client.tasks)
+    for account, users in accounts.items():
+        for user_name, user in users.items():
+            for client_name, client in user.clients.items():
+                for task_name, task in client.tasks.items():
+                    task.account = account
+                    key = (user_name, client_name, task_name)
+                    if seen[key] > 1:
+                        key = (user_name, client_name, f"{task_name} ({account})")
+                    tasks[key] = task
+    return group_tasks(tasks)
+
+
+def classify_entry(
     entry: dict[str, Any],
-    users: dict[str, User],
-    hourly_rate: Fraction | None,
-    agency_rate: Fraction | None,
-) -> None:
+    hourly_rate: Fixed | None,
+    agency_rate: Fixed | None,
+) -> tuple[str, str, bool, Fixed] | None:
+    """
+    Return (client name, task name, is external, hourly rate) for an entry,
+    or None if it cannot be billed.
+    """
     task_name = entry["task"]["name"]
     is_external = (
         entry["client"]["name"].startswith("External - ") or agency_rate is None
@@ -82,46 +140,109 @@ def process_entry(
     if hourly_rate is not None:
         rate = hourly_rate
     else:
-        rate = entry["billable_rate"]
-        if rate == 0 or rate is None:
+        billable_rate = entry["billable_rate"]
+        if billable_rate == 0 or billable_rate is None:
             if entry["billable"]:
                 print(
                     f"WARNING, hourly rate for {client_name}/{project_name}/{task_name} is 0.0, skip for export",
                     file=sys.stderr,
                 )
-            return
+            return None
+        rate = Fixed.parse(billable_rate)
 
-    task = users[entry["user"]["name"]].clients[client_name].tasks[task_name]
-    task.name = task_name
-    task.client = client_name
-    task.is_external = is_external
-    if task.is_external:
-        task.hourly_rate = rate
-    else:
+    if not is_external:
         assert agency_rate is not None
         # the developer's hourly rate is what we charge to the customer, minus 25%
-        task.hourly_rate = rate * agency_rate
-    rounded_hours = Fraction(entry["rounded_hours"])
-    task.rounded_hours += rounded_hours
-    task.is_external = is_external
+        rate = rate * agency_rate
+    return client_name, task_name, is_external, rate
+
 
-    if task.currency == "":
-        task.currency = entry["client"]["currency"]
+def process_entry(
+    entry: dict[str, Any],
+    tasks: dict[TaskKey, Task],
+    hourly_rate: Fixed | None,
+    agency_rate: Fixed | None,
+    rates: DailyRates | None = None,
+) -> None:
+    classified = classify_entry(entry, hourly_rate, agency_rate)
+    if classified is None:
+        return
+    client_name, task_name, is_external, rate = classified
+
+    key = (
+        sys.intern(entry["user"]["name"]),
+        sys.intern(client_name),
+        sys.intern(task_name),
+    )
+    task = tasks.get(key)
+    if task is None:
+        task = tasks[key] = Task(
+            name=key[2], client=key[1], currency=entry["client"]["currency"]
+        )
     else:
         msg = f"Currency of customer changed from {task.currency} to {entry['client']['currency']} within the billing period. This is not supported!"
         assert task.currency == entry["client"]["currency"], msg
-    task.cost += rounded_hours * Fraction(task.hourly_rate)
+    task.is_external = is_external
+    task.hourly_rate = rate
+    rounded_hours = Fixed.parse(entry["rounded_hours"])
+    task.rounded_hours += rounded_hours
+    cost = rounded_hours * rate
+    task.cost += cost
+    if rates is not None:
+        task.target_currency = rates.target
+        daily_rate = rates.rate(task.currency, entry["spent_date"])
+        task.target_cost += cost.as_fraction() * daily_rate
+
+
+def prefetch_exchange_rates(
+    entries: Iterable[dict[str, Any]],
+    currency: str,
+    rates: DailyRates | None = None,
+) -> Iterator[dict[str, Any]]:
+    """
+    Pass entries through unchanged, looking up the exchange rate of every
+    client currency in the background as soon as the first entry with it
+    arrives. Rates are then fetched while the remaining pages download,
+    instead of after all of them.
+    """
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        seen = {currency}
+        futures: list[Future[Fraction]] = []
+        for entry in entries:
+            source = entry["client"]["currency"]
+            if source not in seen:
+                seen.add(source)
+                if rates is None:
+                    futures.append(pool.submit(exchange_rate, source, currency))
+                else:
+                    futures.append(pool.submit(rates.rate, source, rates.start))
+            yield entry
+        # raise lookup errors here rather than halfway through the export
+        for future in futures:
+            future.result()
 
 
 def aggregate_time_entries(
-    entries: list[dict[str, Any]],
-    hourly_rate: Fraction | None,
-    agency_rate: Fraction | None,
+    entries: Iterable[dict[str, Any]],
+    hourly_rate: Fixed | None,
+    agency_rate: Fixed | None,
+    rates: DailyRates | None = None,
 ) -> dict[str, User]:
-    users: dict[str, User] = defaultdict(User)
+    tasks: dict[TaskKey, Task] = {}
     for entry in entries:
-        process_entry(entry, users, hourly_rate, agency_rate)
-
-    for user in users.values():
-        user.sort()
-    return OrderedDict(sorted(users.items()))
+        process_entry(entry, tasks, hourly_rate, agency_rate, rates)
+    return group_tasks(tasks)
+
+
+def aggregate_time_entries_by_month(
+    entries: Iterable[dict[str, Any]],
+    hourly_rate: Fixed | None,
+    agency_rate: Fixed | None,
+    rates: DailyRates | None = None,
+) -> dict[str, dict[str, User]]:
+    """Like aggregate_time_entries, but bucketed by the YYYY-MM of spent_date."""
+    months: dict[str, dict[TaskKey, Task]] = defaultdict(dict)
+    for entry in entries:
+        month = entry["spent_date"][:7]
+        process_entry(entry, months[month], hourly_rate, agency_rate, rates)
+    return {month: group_tasks(tasks) for month, tasks in sorted(months.items())}
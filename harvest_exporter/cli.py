@@ -2,14 +2,35 @@
 
 import argparse
 import calendar
+import contextlib
+import itertools
 import os
 import sys
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
-from fractions import Fraction
+from pathlib import Path
+from typing import Any
 
-from harvest import get_time_entries
+from harvest import (
+    MAX_WORKERS,
+    iter_time_entries,
+    iter_time_entries_for_ranges,
+)
+from harvest.ids import resolve_filters
+from harvest.store import get_time_entries_cached
 
-from . import Task, aggregate_time_entries, export
+from . import (
+    Task,
+    User,
+    aggregate_time_entries,
+    aggregate_time_entries_by_month,
+    export,
+    merge_accounts,
+    prefetch_exchange_rates,
+)
+from .fixed import Fixed
+from .transferwise import DailyRates, invalidate_exchange_rates
 
 
 def parse_args() -> argparse.Namespace:
@@ -28,18 +49,18 @@ def parse_args() -> argparse.Namespace:
         "--harvest-account-id",
         default=account,
         required=account is None,
-        help="Get one from https://id.getharvest.com/developers (env: HARVEST_ACCOUNT_ID)",
+        help="Get one from https://id.getharvest.com/developers, comma separated to export several accounts at once (env: HARVEST_ACCOUNT_ID)",
     )
     token = os.environ.get("HARVEST_BEARER_TOKEN")
     parser.add_argument(
         "--harvest-bearer-token",
         default=os.environ.get("HARVEST_BEARER_TOKEN"),
         required=token is None,
-        help="Get one from https://id.getharvest.com/developers (env: HARVEST_BEARER_TOKEN)",
+        help="Get one from https://id.getharvest.com/developers, comma separated with one token per account, or one for all of them (env: HARVEST_BEARER_TOKEN)",
     )
     parser.add_argument(
         "--hourly-rate",
-        type=Fraction,
+        type=Fixed.parse,
         help="Use this hourly rate instead of the one from harvest",
     )
     parser.add_argument(
@@ -63,7 +84,7 @@ def parse_args() -> argparse.Namespace:
         type=int,
         nargs="+",
         choices=range(1, 13),
-        help="Months to generate report for (conflicts with `--start` and `--end`)",
+        help="Months to generate report for (conflicts with `--start` and `--end`, non-contiguous months need `--per-month`)",
     )
     parser.add_argument(
         "--year",
@@ -81,12 +102,54 @@ def parse_args() -> argparse.Namespace:
         type=str,
         help="Target currency to convert to, i.e EUR",
     )
+    parser.add_argument(
+        "--daily-rates",
+        action="store_true",
+        help="Convert every entry at the exchange rate of its day from the Wise rate history instead of today's quote (env: WISE_API_TOKEN)",
+    )
+    parser.add_argument(
+        "--refresh-rates",
+        action="store_true",
+        help="Drop cached exchange rates and fetch new quotes",
+    )
+    parser.add_argument(
+        "--workers",
+        default=MAX_WORKERS,
+        type=int,
+        help="Number of Harvest pages to download in parallel",
+    )
+    parser.add_argument(
+        "--entry-store",
+        type=Path,
+        default=os.environ.get("HARVEST_ENTRY_STORE"),
+        help="SQLite file to keep time entries in, later runs only download changed entries (env: HARVEST_ENTRY_STORE)",
+    )
+    parser.add_argument(
+        "--full-sync",
+        action="store_true",
+        help="Re-download the whole date range into --entry-store, i.e. to drop deleted entries",
+    )
+    parser.add_argument(
+        "--per-month",
+        action="store_true",
+        help="Emit one report per month of the date range from a single download",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=Path,
+        help="With --per-month, write one file per month (i.e. 2024-03.json) into this directory instead of stdout",
+    )
+    parser.add_argument(
+        "--raw-entries",
+        type=Path,
+        help="Also write the downloaded time entries to this file, as Arrow if it ends in .arrow or .feather, otherwise as Parquet (needs pyarrow)",
+    )
     parser.add_argument(
         "--format",
-        default="humanreadable",
-        choices=("humanreadable", "csv", "json", "table"),
-        type=str,
-        help="Output format",
+        action="append",
+        type=parse_format,
+        metavar="FORMAT[=PATH]",
+        help=f"Output format, one of {', '.join(FORMATS)}. Repeat to write several formats from one download, each to its own PATH. Without it, humanreadable is written to stdout",
     )
     args = parser.parse_args()
     today = datetime.today()
@@ -102,6 +165,10 @@ def parse_args() -> argparse.Namespace:
         months = sorted(args.months)
         args.start = get_month_range(year, months[0])[0]
         args.end = get_month_range(year, months[-1])[1]
+        args.ranges = [
+            (get_month_range(year, run[0])[0], get_month_range(year, run[-1])[1])
+            for run in contiguous_runs(months)
+        ]
     elif (args.start and not args.end) or (args.end and not args.start):
         print("both --start and --end flag must be passed", file=sys.stderr)
         sys.exit(1)
@@ -112,6 +179,70 @@ def parse_args() -> argparse.Namespace:
         args.start = end_of_previous_month.strftime("%Y%m01")
         args.end = end_of_previous_month.strftime("%Y%m%d")
 
+    if not args.months:
+        args.ranges = [(args.start, args.end)]
+
+    if len(args.ranges) > 1 and not args.per_month:
+        # a single report has one period, which would claim the skipped months
+        print(
+            "non-contiguous --months require --per-month, or select a contiguous range",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    if args.output_dir and not args.per_month:
+        print("--output-dir requires --per-month", file=sys.stderr)
+        sys.exit(1)
+
+    account_ids = args.harvest_account_id.split(",")
+    tokens = args.harvest_bearer_token.split(",")
+    if len(tokens) == 1:
+        # a personal access token can be valid for several accounts
+        tokens *= len(account_ids)
+    if len(tokens) != len(account_ids):
+        print(
+            "pass one --harvest-bearer-token per account or one for all of them",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+    args.accounts = list(zip(account_ids, tokens, strict=True))
+
+    if not args.format:
+        args.format = [("humanreadable", None)]
+    if args.output_dir:
+        if any(path is not None for _, path in args.format):
+            print(
+                "--output-dir names the files itself, pass --format without a path",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+        extensions = [extension(fmt) for fmt, _ in args.format]
+        if len(set(extensions)) != len(extensions):
+            print(
+                "formats must have distinct extensions with --output-dir",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+    else:
+        if [path for _, path in args.format].count(None) > 1:
+            print("only one --format can be written to stdout", file=sys.stderr)
+            sys.exit(1)
+        for fmt, path in args.format:
+            if fmt in TABLE_FORMATS and path is None:
+                print(
+                    f"--format {fmt} needs a path, i.e. {fmt}=report.{fmt}",
+                    file=sys.stderr,
+                )
+                sys.exit(1)
+
+    if args.raw_entries or any(fmt in TABLE_FORMATS for fmt, _ in args.format):
+        # fail before downloading anything
+        try:
+            export.import_pyarrow()
+        except export.Error as e:
+            print(e, file=sys.stderr)
+            sys.exit(1)
+
     if args.agency == "none" and not args.client:
         print("--client must be passed if agency is disabled", file=sys.stderr)
         sys.exit(1)
@@ -119,6 +250,49 @@ def parse_args() -> argparse.Namespace:
     return args
 
 
+FORMATS = ("humanreadable", "csv", "json", "ndjson", "table", "parquet", "arrow")
+# binary formats, written with pyarrow to a path rather than stdout
+TABLE_FORMATS = ("parquet", "arrow")
+
+
+def parse_format(value: str) -> tuple[str, Path | None]:
+    """Parse FORMAT or FORMAT=PATH."""
+    fmt, sep, path = value.partition("=")
+    if fmt not in FORMATS:
+        msg = f"invalid format {fmt!r}, choose from {', '.join(FORMATS)}"
+        raise argparse.ArgumentTypeError(msg)
+    if sep and not path:
+        msg = f"missing path after {fmt}="
+        raise argparse.ArgumentTypeError(msg)
+    return fmt, Path(path) if sep else None
+
+
+def extension(fmt: str) -> str:
+    return {"humanreadable": "txt", "table": "txt"}.get(fmt, fmt)
+
+
+@contextlib.contextmanager
+def output(path: Path | None) -> Iterator[None]:
+    """Redirect stdout into path, if there is one."""
+    if path is None:
+        yield
+        return
+    with path.open("w") as f, contextlib.redirect_stdout(f):
+        yield
+    print(f"wrote {path}", file=sys.stderr)
+
+
+def contiguous_runs(months: list[int]) -> list[list[int]]:
+    """Split sorted months into runs without gaps, i.e. [1, 2, 12] -> [[1, 2], [12]]."""
+    runs: list[list[int]] = []
+    for month in months:
+        if runs and runs[-1][-1] + 1 == month:
+            runs[-1].append(month)
+        else:
+            runs.append([month])
+    return runs
+
+
 def get_month_range(year: int, month: int) -> tuple[str, str]:
     """Get the start and end dates for a given month and year."""
     _, last_day = calendar.monthrange(year, month)
@@ -127,6 +301,10 @@ def get_month_range(year: int, month: int) -> tuple[str, str]:
     return start, end
 
 
+def parse_date(d: int | str) -> date:
+    return datetime.strptime(str(d), "%Y%m%d").date()
+
+
 def exclude_task(task: Task, args: argparse.Namespace) -> bool:
     if args.client == task.client:
         # allow to export external projects if --client is passed and matches
@@ -137,21 +315,146 @@ def exclude_task(task: Task, args: argparse.Namespace) -> bool:
     return task.is_external
 
 
-NUMTIDE_RATE = Fraction(0.75)
+NUMTIDE_RATE = Fixed.parse("0.75")
+
+
+def harvest_filters(
+    args: argparse.Namespace, account_id: str, access_token: str
+) -> dict[str, int]:
+    """
+    Let Harvest filter by --user / --client where the name maps to exactly one
+    id. The entries are still filtered by name after aggregation.
+    """
+    return resolve_filters(
+        account_id,
+        access_token,
+        user=args.user,
+        client=args.client,
+        agency=args.agency != "none",
+    )
+
+
+def fetch_entries(
+    args: argparse.Namespace, account_id: str, access_token: str
+) -> Iterable[dict[str, Any]]:
+    if args.entry_store:
+        return itertools.chain.from_iterable(
+            get_time_entries_cached(
+                args.entry_store,
+                account_id,
+                access_token,
+                start,
+                end,
+                full_sync=args.full_sync,
+                max_workers=args.workers,
+            )
+            # newest range first, like Harvest orders entries
+            for start, end in reversed(args.ranges)
+        )
+    if len(args.ranges) > 1:
+        # non-contiguous --months: only download the selected months
+        return iter_time_entries_for_ranges(
+            account_id,
+            access_token,
+            args.ranges,
+            max_workers=args.workers,
+            filters=harvest_filters(args, account_id, access_token),
+        )
+    # stream pages straight into the aggregation
+    return iter_time_entries(
+        account_id,
+        access_token,
+        args.start,
+        args.end,
+        max_workers=args.workers,
+        filters=harvest_filters(args, account_id, access_token),
+    )
+
+
+# Aggregated users per period: one per month with --per-month, otherwise a
+# single period "" covering the whole date range
+Periods = dict[str, dict[str, User]]
+
+
+def aggregate_account(
+    args: argparse.Namespace,
+    account_id: str,
+    access_token: str,
+    agency_rate: Fixed | None,
+    rates: DailyRates | None,
+    recorder: export.EntryRecorder | None,
+) -> Periods:
+    entries = fetch_entries(args, account_id, access_token)
+    entries = prefetch_exchange_rates(entries, args.currency, rates)
+    if recorder:
+        entries = recorder.record(entries, account_id)
+
+    if args.per_month:
+        return aggregate_time_entries_by_month(
+            entries, args.hourly_rate, agency_rate, rates
+        )
+    users = aggregate_time_entries(entries, args.hourly_rate, agency_rate, rates)
+    return {"": users}
+
+
+def aggregate_accounts(
+    args: argparse.Namespace,
+    agency_rate: Fixed | None,
+    rates: DailyRates | None,
+    recorder: export.EntryRecorder | None,
+) -> Periods:
+    """
+    Download and aggregate all accounts in parallel, so that the wall time is
+    the one of the slowest account, then merge them into one tree per period.
+    """
+    with ThreadPoolExecutor(max_workers=len(args.accounts)) as pool:
+        futures = {
+            account_id: pool.submit(
+                aggregate_account,
+                args,
+                account_id,
+                access_token,
+                agency_rate,
+                rates,
+                recorder,
+            )
+            for account_id, access_token in args.accounts
+        }
+        results = {account_id: f.result() for account_id, f in futures.items()}
+
+    if len(results) == 1:
+        return next(iter(results.values()))
+    periods = sorted({period for result in results.values() for period in result})
+    merged = {}
+    for period in periods:
+        accounts = {account_id: r.get(period, {}) for account_id, r in results.items()}
+        merged[period] = merge_accounts(accounts)
+    return merged
 
 
 def main() -> None:
     args = parse_args()
-    entries = get_time_entries(
-        args.harvest_account_id, args.harvest_bearer_token, args.start, args.end
-    )
+    if args.refresh_rates:
+        invalidate_exchange_rates()
 
     agency_rate = None
     if args.agency == "numtide":
         agency_rate = NUMTIDE_RATE
 
-    users = aggregate_time_entries(entries, args.hourly_rate, agency_rate)
+    rates = None
+    if args.daily_rates:
+        rates = DailyRates(args.currency, parse_date(args.start), parse_date(args.end))
+    recorder = export.EntryRecorder() if args.raw_entries else None
+
+    periods = aggregate_accounts(args, agency_rate, rates, recorder)
+    if recorder:
+        write_raw_entries(recorder, args.raw_entries)
 
+    if args.per_month:
+        export_per_month(args, periods)
+        return
+
+    users = periods[""]
     if args.user:
         for_user = users.get(args.user)
         if not for_user:
@@ -162,6 +465,23 @@ def main() -> None:
             sys.exit(1)
         users = {args.user: for_user}
 
+    exclude_tasks(users, args)
+
+    report = export.Report(users, args.start, args.end)
+    if len(args.format) == 1 and args.format[0][0] in ("csv", "ndjson"):
+        # write every row as soon as it is converted
+        fmt, path = args.format[0]
+        with output(path):
+            write_rows(fmt, export.iter_rows(report, args.currency))
+        return
+
+    # convert once, render every format from the same rows
+    rows = export.materialize(report, args.currency)
+    for fmt, path in args.format:
+        write_output(fmt, [rows], path)
+
+
+def exclude_tasks(users: dict[str, User], args: argparse.Namespace) -> None:
     for user in users.values():
         for client in user.clients.values():
             to_delete = []
@@ -171,16 +491,70 @@ def main() -> None:
             for name in to_delete:
                 del client.tasks[name]
 
-    fn = None
-    if args.format == "humanreadable":
-        fn = export.as_humanreadable
-    elif args.format == "csv":
-        fn = export.as_csv
-    elif args.format == "table":
-        fn = export.as_rich_table
-    else:  # args.format == "json":
-        fn = export.as_json
-    fn(users, args.start, args.end, args.currency)
+
+def export_per_month(args: argparse.Namespace, months: Periods) -> None:
+    reports = []
+    for month, users in months.items():
+        year, month_number = (int(part) for part in month.split("-"))
+        if args.months and month_number not in args.months:
+            continue
+        if args.user:
+            if args.user not in users:
+                continue
+            users = {args.user: users[args.user]}
+        exclude_tasks(users, args)
+        start, end = get_month_range(year, month_number)
+        # the first and last month may only be partially covered
+        start = max(start, str(args.start))
+        end = min(end, str(args.end))
+        report = export.Report(users, start, end)
+        reports.append((month, export.materialize(report, args.currency)))
+
+    if args.output_dir:
+        args.output_dir.mkdir(parents=True, exist_ok=True)
+        for fmt, _ in args.format:
+            for month, rows in reports:
+                path = args.output_dir / f"{month}.{extension(fmt)}"
+                write_output(fmt, [rows], path)
+    else:
+        for fmt, path in args.format:
+            write_output(fmt, [rows for _, rows in reports], path)
+
+
+def write_rows(fmt: str, rows: Iterable[export.ReportRow]) -> None:
+    if fmt == "csv":
+        export.render_csv(rows)
+    elif fmt == "ndjson":
+        export.render_ndjson(rows)
+    else:  # fmt == "json"
+        export.render_json(rows)
+
+
+def write_raw_entries(recorder: export.EntryRecorder, path: Path) -> None:
+    fmt = "arrow" if path.suffix in (".arrow", ".feather") else "parquet"
+    recorder.write(fmt, path)
+    print(f"wrote {path}", file=sys.stderr)
+
+
+def write_output(fmt: str, reports: list[export.ReportRows], path: Path | None) -> None:
+    if fmt in TABLE_FORMATS:
+        assert path is not None
+        rows = itertools.chain.from_iterable(r.rows for r in reports)
+        export.write_rows_table(fmt, rows, path)
+        print(f"wrote {path}", file=sys.stderr)
+        return
+    with output(path):
+        write_reports(fmt, reports)
+
+
+def write_reports(fmt: str, reports: list[export.ReportRows]) -> None:
+    """Grouped output: one CSV table / JSON list, or one section per report."""
+    if fmt in ("csv", "json", "ndjson"):
+        write_rows(fmt, itertools.chain.from_iterable(r.rows for r in reports))
+    else:
+        fn = export.render_rich_table if fmt == "table" else export.render_humanreadable
+        for report in reports:
+            fn(report)
 
 
 if __name__ == "__main__":
@@ -1,55 +1,132 @@
 import csv
+import itertools
 import json
 import sys
+import threading
+from collections.abc import Iterable, Iterator
+from datetime import date, datetime
 from fractions import Fraction
+from pathlib import Path
+from typing import Any, NamedTuple
 
 from rich.console import Console
 from rich.table import Table
 
 from . import User
+from .fixed import Fixed
 
 
-def round_cents(n: Fraction) -> float:
+def round_cents(n: Fixed | Fraction) -> float:
     """
     Use this method only for displaying currencies to avoid rounding errors
     """
     return float(round(n, 2))
 
 
-def as_humanreadable(
-    users: dict[str, User],
-    start_date: int,
-    end_date: int,
-    currency: str,
-) -> None:
-    print(f"time: {start_date} -> {end_date}")
-    for user_name, user in users.items():
-        print(f"{user_name}:")
-        currencies = {}
+class Report(NamedTuple):
+    users: dict[str, User]
+    start_date: int | str
+    end_date: int | str
+
+
+class ReportRow(NamedTuple):
+    """One task of a report, converted and rounded for display."""
+
+    user: str
+    start_date: int | str
+    end_date: int | str
+    agency: str
+    client: str
+    task: str
+    rounded_hours: float
+    source_hourly_rate: float
+    source_cost: float
+    source_currency: str
+    target_hourly_rate: float
+    target_cost: float
+    target_currency: str
+    # exact, so that the table rounds it like the amounts; a float in every
+    # exported format
+    exchange_rate: Fraction
+    # Harvest account, only set when several accounts are exported together
+    account: str = ""
+
+
+class ReportRows(NamedTuple):
+    start_date: int | str
+    end_date: int | str
+    currency: str
+    rows: tuple[ReportRow, ...]
+
+
+# streaming formats flush stdout after this many rows
+FLUSH_EVERY = 100
+
+
+def iter_rows(report: Report, currency: str) -> Iterator[ReportRow]:
+    """Convert and round the tasks of the report one by one."""
+    for user_name, user in report.users.items():
         for client_name, client in user.clients.items():
-            for task_name, task in client.tasks.items():
-                if task.currency != currency:
-                    currencies[task.currency] = task.exchange_rate(currency)
-                round_cents(task.cost)
-                converted_cost = round_cents(task.converted_cost(currency))
-                converted_hourly_rate = round_cents(
-                    task.converted_hourly_rate(currency)
+            # the tree key of a task may carry its account, see merge_accounts
+            for task in client.tasks.values():
+                rate = task.exchange_rate(currency)
+                yield ReportRow(
+                    user=user_name,
+                    start_date=report.start_date,
+                    end_date=report.end_date,
+                    agency=task.agency,
+                    client=client_name,
+                    task=task.name,
+                    rounded_hours=float(task.rounded_hours),
+                    source_hourly_rate=round_cents(task.hourly_rate),
+                    source_cost=round_cents(task.cost),
+                    source_currency=task.currency,
+                    target_hourly_rate=round_cents(
+                        task.hourly_rate.as_fraction() * rate
+                    ),
+                    target_cost=round_cents(task.converted_cost(currency)),
+                    target_currency=currency,
+                    exchange_rate=rate,
+                    account=task.account,
                 )
 
-                print(
-                    f"  {client_name} - {task_name} ({float(round(task.hourly_rate, 2))} {task.currency}/h -> {converted_hourly_rate} {currency}/h): {float(task.rounded_hours)}h -> {converted_cost} {currency}"
-                )
+
+def row_dict(row: ReportRow) -> dict[str, Any]:
+    data = row._asdict()
+    data["exchange_rate"] = float(row.exchange_rate)
+    if not row.account:
+        # reports of a single account keep their columns
+        del data["account"]
+    return data
+
+
+def materialize(report: Report, currency: str) -> ReportRows:
+    """
+    Convert and round every task of the report once; all formats render
+    from the result, so writing several formats repeats no arithmetic.
+    """
+    rows = tuple(iter_rows(report, currency))
+    return ReportRows(report.start_date, report.end_date, currency, rows)
+
+
+def render_humanreadable(report: ReportRows) -> None:
+    print(f"time: {report.start_date} -> {report.end_date}")
+    for user_name, rows in itertools.groupby(report.rows, key=lambda r: r.user):
+        print(f"{user_name}:")
+        currencies = {}
+        for row in rows:
+            if row.source_currency != report.currency:
+                currencies[row.source_currency] = float(row.exchange_rate)
+            print(
+                f"  {row.client} - {row.task} ({row.source_hourly_rate} {row.source_currency}/h -> {row.target_hourly_rate} {report.currency}/h): {row.rounded_hours}h -> {row.target_cost} {report.currency}"
+            )
         print("Exchange rates")
         for source_currency, rate in currencies.items():
-            print(f"1 {source_currency} -> {float(rate)} {currency}")
+            print(f"1 {source_currency} -> {rate} {report.currency}")
 
 
-def as_csv(
-    users: dict[str, User],
-    start_date: int,
-    end_date: int,
-    currency: str,
-) -> None:
+def render_csv(rows: Iterable[ReportRow]) -> None:
+    """Write rows as they come, i.e. of several months, as one CSV table."""
     fieldnames = [
         "user",
         "start_date",
@@ -67,75 +144,43 @@ def as_csv(
         "exchange_rate",
     ]
 
+    # peek at the first row: the account column only exists when several
+    # accounts are exported together
+    it = iter(rows)
+    first = next(it, None)
+    if first is not None and first.account:
+        fieldnames.append("account")
     writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
     writer.writeheader()
-    for user_name, user in users.items():
-        for client_name, client in user.clients.items():
-            for task_name, task in client.tasks.items():
-                writer.writerow(
-                    dict(
-                        user=user_name,
-                        start_date=start_date,
-                        end_date=end_date,
-                        agency=task.agency,
-                        client=client_name,
-                        task=task_name,
-                        rounded_hours=float(task.rounded_hours),
-                        source_hourly_rate=round_cents(task.hourly_rate),
-                        source_cost=round_cents(task.cost),
-                        source_currency=task.currency,
-                        target_hourly_rate=round_cents(
-                            task.converted_hourly_rate(currency)
-                        ),
-                        target_cost=round_cents(task.converted_cost(currency)),
-                        target_currency=currency,
-                        exchange_rate=float(task.exchange_rate(currency)),
-                    )
-                )
+    if first is not None:
+        it = itertools.chain([first], it)
+    for n, row in enumerate(it, 1):
+        writer.writerow(row_dict(row))
+        if n % FLUSH_EVERY == 0:
+            sys.stdout.flush()
+    sys.stdout.flush()
 
 
-def as_json(
-    users: dict[str, User],
-    start_date: int,
-    end_date: int,
-    currency: str,
-) -> None:
-    data = []
-    for user_name, user in users.items():
-        for client_name, client in user.clients.items():
-            for task_name, task in client.tasks.items():
-                data.append(
-                    dict(
-                        user=user_name,
-                        start_date=start_date,
-                        end_date=end_date,
-                        agency=task.agency,
-                        client=client_name,
-                        task=task_name,
-                        rounded_hours=float(task.rounded_hours),
-                        source_hourly_rate=round_cents(task.hourly_rate),
-                        source_cost=round_cents(task.cost),
-                        source_currency=task.currency,
-                        target_hourly_rate=round_cents(
-                            task.converted_hourly_rate(currency)
-                        ),
-                        target_cost=round_cents(task.converted_cost(currency)),
-                        target_currency=currency,
-                        exchange_rate=float(task.exchange_rate(currency)),
-                    )
-                )
+def render_json(rows: Iterable[ReportRow]) -> None:
+    """Write rows, i.e. of several months, as one JSON list."""
+    data = [row_dict(row) for row in rows]
     json.dump(data, sys.stdout, indent=4, sort_keys=True)
 
 
-def as_rich_table(
-    users: dict[str, User],
-    start_date: int,
-    end_date: int,
-    currency: str,
-) -> None:
+def render_ndjson(rows: Iterable[ReportRow]) -> None:
+    """Write one JSON object per line as soon as each row is ready."""
+    for n, row in enumerate(rows, 1):
+        sys.stdout.write(json.dumps(row_dict(row), sort_keys=True) + "\n")
+        if n % FLUSH_EVERY == 0:
+            sys.stdout.flush()
+    sys.stdout.flush()
+
+
+def render_rich_table(report: ReportRows) -> None:
     console = Console()
+    currency = report.currency
 
-    table_title = f"Time Report: {start_date} to {end_date}"
+    table_title = f"Time Report: {report.start_date} to {report.end_date}"
     table = Table(title=table_title, show_header=True, header_style="bold magenta")
     table.add_column("User", style="dim")
     table.add_column("Client")
@@ -151,28 +196,22 @@ def as_rich_table(
     total_target_cost = 0.0
     total_hours = 0.0
 
-    for user_name, user in users.items():
-        for client_name, client in user.clients.items():
-            for task_name, task in client.tasks.items():
-                source_cost = round_cents(task.cost)
-                target_cost = round_cents(task.converted_cost(currency))
-                task_hours = float(task.rounded_hours)
-
-                total_source_cost += source_cost
-                total_target_cost += target_cost
-                total_hours += task_hours
-
-                table.add_row(
-                    user_name,
-                    client_name,
-                    task_name,
-                    f"{task_hours:.2f}",
-                    f"{source_cost:.2f} {task.currency}",
-                    f"{round_cents(task.hourly_rate):.2f} {task.currency}/hr",
-                    f"{target_cost:.2f} {currency}",
-                    f"{round_cents(task.converted_hourly_rate(currency)):.2f} {currency}/hr",
-                    f"1 {task.currency} = {round_cents(task.exchange_rate(currency)):.2f} {currency}",
-                )
+    for row in report.rows:
+        total_source_cost += row.source_cost
+        total_target_cost += row.target_cost
+        total_hours += row.rounded_hours
+
+        table.add_row(
+            row.user,
+            row.client,
+            row.task,
+            f"{row.rounded_hours:.2f}",
+            f"{row.source_cost:.2f} {row.source_currency}",
+            f"{row.source_hourly_rate:.2f} {row.source_currency}/hr",
+            f"{row.target_cost:.2f} {currency}",
+            f"{row.target_hourly_rate:.2f} {currency}/hr",
+            f"1 {row.source_currency} = {round_cents(row.exchange_rate):.2f} {currency}",
+        )
 
     # Add a separator
     table.add_row("", "", "", "", "", "", "", "", "", end_section=True)
@@ -192,3 +231,163 @@ def as_rich_table(
     )
 
     console.print(table)
+
+
+class Error(Exception):
+    pass
+
+
+def import_pyarrow() -> Any:
+    # optional dependency, only needed for the parquet/arrow formats
+    try:
+        import pyarrow as pa  # noqa: PLC0415
+        import pyarrow.feather  # noqa: PLC0415
+        import pyarrow.parquet  # noqa: PLC0415
+    except ImportError as e:
+        msg = "the parquet and arrow formats need pyarrow, i.e. nix-shell -p python3.pkgs.pyarrow"
+        raise Error(msg) from e
+    return pa
+
+
+def _date(d: int | str) -> date:
+    return datetime.strptime(str(d).replace("-", ""), "%Y%m%d").date()
+
+
+def write_table(fmt: str, columns: dict[str, Any], path: Path) -> None:
+    """
+    Write typed columns as Parquet (zstd compressed, smallest on disk) or as
+    an uncompressed Arrow IPC file, which pyarrow and pandas can memory map
+    without copying.
+    """
+    pa = import_pyarrow()
+    table = pa.table(
+        {
+            name: (
+                pa.array(values, pa.string()).dictionary_encode()
+                if kind == "category"
+                else pa.array(values, getattr(pa, kind)())
+            )
+            for name, (kind, values) in columns.items()
+        }
+    )
+    if fmt == "parquet":
+        pa.parquet.write_table(table, path, compression="zstd")
+    else:
+        pa.feather.write_feather(table, path, compression="uncompressed")
+
+
+def write_rows_table(fmt: str, rows: Iterable[ReportRow], path: Path) -> None:
+    """Write report rows, i.e. of several months, as one parquet/arrow table."""
+    rows = list(rows)
+
+    def column(kind: str, name: str, convert: Any = None) -> tuple[str, list[Any]]:
+        values = [getattr(row, name) for row in rows]
+        return kind, values if convert is None else [convert(v) for v in values]
+
+    columns = {
+        "user": column("category", "user"),
+        "start_date": column("date32", "start_date", _date),
+        "end_date": column("date32", "end_date", _date),
+        "agency": column("category", "agency"),
+        "client": column("category", "client"),
+        "task": column("category", "task"),
+        "rounded_hours": column("float64", "rounded_hours"),
+        "source_cost": column("float64", "source_cost"),
+        "source_currency": column("category", "source_currency"),
+        "source_hourly_rate": column("float64", "source_hourly_rate"),
+        "target_cost": column("float64", "target_cost"),
+        "target_currency": column("category", "target_currency"),
+        "target_hourly_rate": column("float64", "target_hourly_rate"),
+        "exchange_rate": column("float64", "exchange_rate", float),
+    }
+    if any(row.account for row in rows):
+        columns["account"] = column("category", "account")
+    write_table(fmt, columns, path)
+
+
+class EntryRecorder:
+    """Keeps the raw time entries passing through, column by column."""
+
+    def __init__(self) -> None:
+        self.columns: dict[str, tuple[str, list[Any]]] = {
+            "id": ("int64", []),
+            "user": ("category", []),
+            "client": ("category", []),
+            "project": ("category", []),
+            "task": ("category", []),
+            "spent_date": ("date32", []),
+            "rounded_hours": ("float64", []),
+            "billable": ("bool_", []),
+            "billable_rate": ("float64", []),
+            "currency": ("category", []),
+            "account": ("category", []),
+        }
+        # accounts are downloaded in parallel, keep the columns aligned
+        self._lock = threading.Lock()
+
+    def record(
+        self, entries: Iterable[dict[str, Any]], account: str
+    ) -> Iterator[dict[str, Any]]:
+        append = {name: values.append for name, (_, values) in self.columns.items()}
+        for entry in entries:
+            with self._lock:
+                append["id"](entry["id"])
+                append["user"](entry["user"]["name"])
+                append["client"](entry["client"]["name"])
+                append["project"](entry["project"]["name"])
+                append["task"](entry["task"]["name"])
+                append["spent_date"](date.fromisoformat(entry["spent_date"]))
+                append["rounded_hours"](entry["rounded_hours"])
+                append["billable"](entry["billable"])
+                append["billable_rate"](entry["billable_rate"])
+                append["currency"](entry["client"]["currency"])
+                append["account"](account)
+            yield entry
+
+    def write(self, fmt: str, path: Path) -> None:
+        write_table(fmt, self.columns, path)
+
+
+def as_humanreadable(
+    users: dict[str, User],
+    start_date: int,
+    end_date: int,
+    currency: str,
+) -> None:
+    render_humanreadable(materialize(Report(users, start_date, end_date), currency))
+
+
+def as_csv(
+    users: dict[str, User],
+    start_date: int,
+    end_date: int,
+    currency: str,
+) -> None:
+    render_csv(iter_rows(Report(users, start_date, end_date), currency))
+
+
+def as_json(
+    users: dict[str, User],
+    start_date: int,
+    end_date: int,
+    currency: str,
+) -> None:
+    render_json(iter_rows(Report(users, start_date, end_date), currency))
+
+
+def as_ndjson(
+    users: dict[str, User],
+    start_date: int,
+    end_date: int,
+    currency: str,
+) -> None:
+    render_ndjson(iter_rows(Report(users, start_date, end_date), currency))
+
+
+def as_rich_table(
+    users: dict[str, User],
+    start_date: int,
+    end_date: int,
+    currency: str,
+) -> None:
+    render_rich_table(materialize(Report(users, start_date, end_date), currency))
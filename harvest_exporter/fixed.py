@@ -0,0 +1,133 @@
+from decimal import ROUND_HALF_EVEN, Decimal, InvalidOperation
+from fractions import Fraction
+from functools import total_ordering
+from typing import Any
+
+SCALE = 10**6
+
+
+def _div_half_even(n: int, d: int) -> int:
+    q, r = divmod(n, d)
+    if 2 * r > d or (2 * r == d and q % 2 == 1):
+        q += 1
+    return q
+
+
+def _parse(text: str) -> int:
+    """Parse a decimal number into micro units without going through binary floats."""
+    sign = 1
+    if text[:1] == "-":
+        sign, text = -1, text[1:]
+    whole, dot, frac = text.partition(".")
+    if whole.isdigit() and (not dot or frac.isdigit()) and len(frac) <= 6:
+        return sign * (int(whole) * SCALE + int(frac.ljust(6, "0") or 0))
+    # exponents or more than 6 decimals
+    try:
+        micros = (Decimal(text) * SCALE).quantize(Decimal(1), rounding=ROUND_HALF_EVEN)
+    except InvalidOperation as e:
+        # i.e. "abc", "nan" or "inf"; argparse reports ValueErrors as invalid values
+        msg = f"invalid decimal number: {text!r}"
+        raise ValueError(msg) from e
+    return sign * int(micros)
+
+
+@total_ordering
+class Fixed:
+    """
+    Exact decimal amount in integer micro units (1e-6), used for hours and money.
+
+    Values are parsed from their decimal text, so 123.45 from the Harvest JSON
+    is exactly 123.45 rather than the nearest binary float. Sums are exact;
+    products that do not fit into micro units are rounded half to even, which
+    is also how values are rounded to cents. Currency conversions are done on
+    as_fraction(), so that they are only rounded once, to cents.
+    """
+
+    __slots__ = ("micros",)
+
+    def __init__(self, micros: int = 0) -> None:
+        self.micros = micros
+
+    @classmethod
+    def parse(cls, value: "Fixed | str | float | Fraction") -> "Fixed":
+        if isinstance(value, Fixed):
+            return value
+        if isinstance(value, int):
+            return cls(value * SCALE)
+        if isinstance(value, float):
+            # repr() is the shortest text that round trips, i.e. what the
+            # JSON contained
+            return cls(_parse(repr(value)))
+        if isinstance(value, Fraction):
+            return cls(round(value * SCALE))
+        return cls(_parse(value.strip()))
+
+    def as_fraction(self) -> Fraction:
+        return Fraction(self.micros, SCALE)
+
+    def __add__(self, other: "Fixed | int") -> "Fixed":
+        if isinstance(other, Fixed):
+            return Fixed(self.micros + other.micros)
+        if isinstance(other, int):
+            return Fixed(self.micros + other * SCALE)
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other: "Fixed") -> "Fixed":
+        if isinstance(other, Fixed):
+            return Fixed(self.micros - other.micros)
+        return NotImplemented
+
+    def __neg__(self) -> "Fixed":
+        return Fixed(-self.micros)
+
+    def __mul__(self, other: "Fixed | int") -> "Fixed":
+        if isinstance(other, Fixed):
+            return Fixed(_div_half_even(self.micros * other.micros, SCALE))
+        if isinstance(other, int):
+            return Fixed(self.micros * other)
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def __round__(self, ndigits: int | None = None) -> Any:
+        # half to even like round(Fraction), so cents match the old exports
+        if ndigits is None:
+            return _div_half_even(self.micros, SCALE)
+        step = 10 ** (6 - ndigits)
+        return Fixed(_div_half_even(self.micros, step) * step)
+
+    def __float__(self) -> float:
+        # exact for anything we print, e.g. cents: 12345 / 100 == 123.45
+        return self.micros / SCALE
+
+    def __bool__(self) -> bool:
+        return self.micros != 0
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Fixed):
+            return self.micros == other.micros
+        if isinstance(other, int):
+            return self.micros == other * SCALE
+        return NotImplemented
+
+    def __lt__(self, other: "Fixed | int") -> bool:
+        if isinstance(other, Fixed):
+            return self.micros < other.micros
+        if isinstance(other, int):
+            return self.micros < other * SCALE
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        whole, frac = divmod(self.micros, SCALE)
+        # equal to hash(int) for whole numbers, since we compare equal to them
+        return hash(whole) if frac == 0 else hash(self.micros)
+
+    def __str__(self) -> str:
+        sign = "-" if self.micros < 0 else ""
+        whole, frac = divmod(abs(self.micros), SCALE)
+        return f"{sign}{whole}.{frac:06d}".rstrip("0").rstrip(".")
+
+    def __repr__(self) -> str:
+        return f"Fixed('{self}')"
@@ -0,0 +1,362 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import socketserver
+import stat
+import sys
+import threading
+import time
+import traceback
+import urllib.error
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+
+from harvest import MAX_WORKERS, get_time_entries
+from harvest.store import get_time_entries_cached
+
+from . import aggregate_time_entries, export
+from .cli import NUMTIDE_RATE, exclude_tasks, get_month_range, parse_date
+from .fixed import Fixed
+from .transferwise import DailyRates, invalidate_exchange_rates
+
+# date ranges kept in memory at most, the least recently fetched are dropped
+MAX_RANGES = 32
+
+CONTENT_TYPES = {
+    "json": "application/json",
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "humanreadable": "text/plain; charset=utf-8",
+}
+
+
+class BadRequestError(Exception):
+    pass
+
+
+class EntryCache:
+    """
+    Time entries per date range, kept in memory for `ttl` seconds and for at
+    most `max_ranges` ranges.
+
+    Concurrent requests for the same range wait for one download instead of
+    each starting their own.
+    """
+
+    def __init__(
+        self,
+        account_id: str,
+        access_token: str,
+        ttl: float,
+        max_workers: int = MAX_WORKERS,
+        store: Path | None = None,
+        max_ranges: int = MAX_RANGES,
+    ) -> None:
+        self.account_id = account_id
+        self.access_token = access_token
+        self.ttl = ttl
+        self.max_ranges = max_ranges
+        self.max_workers = max_workers
+        self.store = store
+        self._entries: dict[tuple[str, str], tuple[float, list[dict[str, Any]]]] = {}
+        self._fetching: dict[tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, start: str, end: str) -> list[dict[str, Any]]:
+        if self.store:
+            return get_time_entries_cached(
+                self.store,
+                self.account_id,
+                self.access_token,
+                start,
+                end,
+                max_workers=self.max_workers,
+            )
+        return get_time_entries(
+            self.account_id, self.access_token, int(start), int(end), self.max_workers
+        )
+
+    def _evict(self) -> None:
+        """Drop expired and surplus ranges, called with self._lock held."""
+        now = time.monotonic()
+        for key, (fetched_at, _) in list(self._entries.items()):
+            if now - fetched_at >= self.ttl:
+                del self._entries[key]
+        while len(self._entries) > self.max_ranges:
+            oldest = min(self._entries, key=lambda k: self._entries[k][0])
+            del self._entries[oldest]
+        for key, lock in list(self._fetching.items()):
+            if key not in self._entries and not lock.locked():
+                del self._fetching[key]
+
+    def get(self, start: str, end: str, refresh: bool = False) -> list[dict[str, Any]]:
+        key = (start, end)
+        with self._lock:
+            self._evict()
+            fetching = self._fetching.setdefault(key, threading.Lock())
+        with fetching:
+            cached = self._entries.get(key)
+            if cached and not refresh and time.monotonic() - cached[0] < self.ttl:
+                return cached[1]
+            entries = self._fetch(start, end)
+            with self._lock:
+                self._entries[key] = (time.monotonic(), entries)
+                self._evict()
+            return entries
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def parse_range(query: dict[str, str]) -> tuple[str, str]:
+    if "month" in query:
+        try:
+            year = int(query.get("year", time.strftime("%Y")))
+            return get_month_range(year, int(query["month"]))
+        except ValueError as e:
+            msg = f"invalid month/year: {e}"
+            raise BadRequestError(msg) from e
+    start, end = query.get("start"), query.get("end")
+    if not start or not end:
+        msg = "pass start and end (i.e. 20240101) or month (and year)"
+        raise BadRequestError(msg)
+    for d in (start, end):
+        if not (len(d) == 8 and d.isdigit()):
+            msg = f"invalid date {d!r}, expected YYYYMMDD"
+            raise BadRequestError(msg)
+    return start, end
+
+
+class ReportServer:
+    """The report functions of harvest-exporter with warm caches."""
+
+    def __init__(self, entries: EntryCache, max_ranges: int = MAX_RANGES) -> None:
+        self.entries = entries
+        self.max_ranges = max_ranges
+        # today's quotes stay in transferwise.RATES, daily rates are kept per
+        # report range and, like the entries, for entries.ttl seconds
+        self._daily_rates: dict[tuple[str, str, str], tuple[float, DailyRates]] = {}
+        self._lock = threading.Lock()
+        # the export functions write to stdout, which is global
+        self._render_lock = threading.Lock()
+
+    def daily_rates(self, currency: str, start: str, end: str) -> DailyRates:
+        with self._lock:
+            key = (currency, start, end)
+            # least recently used last, so the first one is dropped
+            cached = self._daily_rates.pop(key, None)
+            if cached is None or time.monotonic() - cached[0] >= self.entries.ttl:
+                cached = (
+                    time.monotonic(),
+                    DailyRates(currency, parse_date(start), parse_date(end)),
+                )
+            self._daily_rates[key] = cached
+            while len(self._daily_rates) > self.max_ranges:
+                del self._daily_rates[next(iter(self._daily_rates))]
+            return cached[1]
+
+    def report(self, query: dict[str, str]) -> tuple[str, str]:
+        """Return (content type, body) for a /report query."""
+        fmt = query.get("format", "json")
+        if fmt not in CONTENT_TYPES:
+            msg = f"invalid format {fmt!r}, choose from {', '.join(CONTENT_TYPES)}"
+            raise BadRequestError(msg)
+        agency = query.get("agency", "numtide")
+        if agency not in ("numtide", "none"):
+            msg = f"invalid agency {agency!r}"
+            raise BadRequestError(msg)
+        client = query.get("client")
+        if agency == "none" and not client:
+            msg = "client must be passed if agency is disabled"
+            raise BadRequestError(msg)
+        try:
+            hourly_rate = (
+                Fixed.parse(query["hourly_rate"]) if "hourly_rate" in query else None
+            )
+        except ValueError as e:
+            msg = f"invalid hourly_rate: {e}"
+            raise BadRequestError(msg) from e
+        start, end = parse_range(query)
+        currency = query.get("currency", "EUR")
+
+        entries = self.entries.get(start, end, refresh="refresh" in query)
+        agency_rate = NUMTIDE_RATE if agency == "numtide" else None
+        rates = (
+            self.daily_rates(currency, start, end) if "daily_rates" in query else None
+        )
+        users = aggregate_time_entries(entries, hourly_rate, agency_rate, rates)
+        user = query.get("user")
+        if user:
+            users = {user: users[user]} if user in users else {}
+        exclude_tasks(users, argparse.Namespace(client=client))
+
+        report = export.materialize(export.Report(users, start, end), currency)
+        buf = io.StringIO()
+        with self._render_lock, contextlib.redirect_stdout(buf):
+            if fmt == "humanreadable":
+                export.render_humanreadable(report)
+            elif fmt == "csv":
+                export.render_csv(report.rows)
+            elif fmt == "ndjson":
+                export.render_ndjson(report.rows)
+            else:
+                export.render_json(report.rows)
+        return CONTENT_TYPES[fmt], buf.getvalue()
+
+    def invalidate(self) -> None:
+        self.entries.clear()
+        with self._lock:
+            self._daily_rates.clear()
+        invalidate_exchange_rates()
+
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = "harvest-exporter"
+    protocol_version = "HTTP/1.1"
+    report_server: ReportServer
+
+    def address_string(self) -> str:
+        # client_address is an empty string on unix sockets
+        if isinstance(self.client_address, tuple):
+            return str(self.client_address[0])
+        return "unix"
+
+    def send_body(self, status: int, content_type: str, body: str) -> None:
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status: int, message: str) -> None:
+        self.send_body(status, "application/json", json.dumps({"error": message}))
+
+    def do_GET(self) -> None:
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == "/health":
+            self.send_body(200, "text/plain", "ok\n")
+            return
+        if url.path != "/report":
+            self.send_error_json(404, f"unknown path {url.path}")
+            return
+        try:
+            content_type, body = self.report_server.report(query)
+        except BadRequestError as e:
+            self.send_error_json(400, str(e))
+        except urllib.error.HTTPError as e:
+            self.send_error_json(502, f"upstream request failed: {e}")
+        except Exception as e:  # noqa: BLE001
+            # answer instead of dropping the connection, i.e. on network
+            # errors or a task changing its currency
+            traceback.print_exc()
+            self.send_error_json(500, f"{type(e).__name__}: {e}")
+        else:
+            self.send_body(200, content_type, body)
+
+    def do_POST(self) -> None:
+        if urllib.parse.urlsplit(self.path).path != "/invalidate":
+            self.send_error_json(404, f"unknown path {self.path}")
+            return
+        try:
+            self.report_server.invalidate()
+        except Exception as e:  # noqa: BLE001
+            traceback.print_exc()
+            self.send_error_json(500, f"{type(e).__name__}: {e}")
+            return
+        self.send_body(200, "application/json", json.dumps({"invalidated": True}))
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Serve harvest-exporter reports over HTTP, keeping time entries and exchange rates in memory",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    account = os.environ.get("HARVEST_ACCOUNT_ID")
+    parser.add_argument(
+        "--harvest-account-id",
+        default=account,
+        required=account is None,
+        help="Get one from https://id.getharvest.com/developers (env: HARVEST_ACCOUNT_ID)",
+    )
+    token = os.environ.get("HARVEST_BEARER_TOKEN")
+    parser.add_argument(
+        "--harvest-bearer-token",
+        default=token,
+        required=token is None,
+        help="Get one from https://id.getharvest.com/developers (env: HARVEST_BEARER_TOKEN)",
+    )
+    parser.add_argument(
+        "--listen",
+        default="127.0.0.1:8080",
+        help="host:port to listen on, or the path of a unix socket",
+    )
+    parser.add_argument(
+        "--entry-ttl",
+        type=float,
+        default=300,
+        help="Seconds to keep downloaded time entries before fetching them again",
+    )
+    parser.add_argument(
+        "--max-ranges",
+        type=int,
+        default=MAX_RANGES,
+        help="Date ranges to keep in memory at most, the least recently fetched are dropped",
+    )
+    parser.add_argument(
+        "--entry-store",
+        type=Path,
+        default=os.environ.get("HARVEST_ENTRY_STORE"),
+        help="SQLite file to sync time entries into, see harvest-exporter (env: HARVEST_ENTRY_STORE)",
+    )
+    parser.add_argument(
+        "--workers",
+        default=MAX_WORKERS,
+        type=int,
+        help="Number of Harvest pages to download in parallel",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    entries = EntryCache(
+        args.harvest_account_id,
+        args.harvest_bearer_token,
+        args.entry_ttl,
+        args.workers,
+        args.entry_store,
+        args.max_ranges,
+    )
+    Handler.report_server = ReportServer(entries, args.max_ranges)
+
+    server: socketserver.BaseServer
+    host, sep, port = args.listen.rpartition(":")
+    if sep and port.isdigit():
+        server = ThreadingHTTPServer((host, int(port)), Handler)
+    else:
+        socket_path = Path(args.listen)
+        if socket_path.exists():
+            # a stale socket of an earlier run, never any other file
+            if not stat.S_ISSOCK(socket_path.stat().st_mode):
+                print(f"{socket_path} exists and is not a socket", file=sys.stderr)
+                sys.exit(1)
+            socket_path.unlink()
+        server = ThreadingUnixHTTPServer(str(socket_path), Handler)
+    print(f"listening on {args.listen}", file=sys.stderr)
+    with server, contextlib.suppress(KeyboardInterrupt):
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
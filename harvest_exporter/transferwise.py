@@ -1,13 +1,104 @@
 #!/usr/bin/env python3
 
-import functools
+import os
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+from contextlib import closing
+from datetime import date, timedelta
 from fractions import Fraction
+from pathlib import Path
+from typing import Any
 
 from rest import http_request
 
+CACHE_PATH = Path(
+    os.environ.get(
+        "EXCHANGE_RATE_CACHE",
+        Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+        / "harvest-exporter"
+        / "rates.sqlite",
+    )
+)
+# quotes are cached per day anyway, this only bounds how stale a rate
+# fetched earlier the same day may be
+CACHE_TTL = float(os.environ.get("EXCHANGE_RATE_TTL", str(24 * 60 * 60)))
+# every currency is quoted against this one, other pairs are derived from it
+BASE_CURRENCY = os.environ.get("EXCHANGE_RATE_BASE", "EUR")
+# maximum relative difference between a derived and a direct quote, i.e.
+# 0.005; unset to trust the derived rates without asking for direct quotes
+TOLERANCE = (
+    Fraction(os.environ["EXCHANGE_RATE_TOLERANCE"])
+    if os.environ.get("EXCHANGE_RATE_TOLERANCE")
+    else None
+)
 
-@functools.cache
-def exchange_rate(source: str, target: str) -> Fraction:
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rates (
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    day TEXT NOT NULL,
+    rate TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (source, target, day)
+);
+"""
+
+
+class RateCache:
+    """
+    Exchange rates on disk, keyed by currency pair and day.
+
+    Every access opens its own SQLite connection, so several processes (and
+    threads) can share the file; SQLite serializes the writers. Rates are
+    stored as their decimal text to keep them exact.
+    """
+
+    def __init__(self, path: Path, ttl: float) -> None:
+        self.path = path
+        self.ttl = ttl
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=30)
+        db.executescript(SCHEMA)
+        return db
+
+    def get(self, source: str, target: str, day: str) -> Fraction | None:
+        with closing(self._connect()) as db:
+            row = db.execute(
+                "SELECT rate FROM rates "
+                "WHERE source = ? AND target = ? AND day = ? AND fetched_at > ?",
+                (source, target, day, time.time() - self.ttl),
+            ).fetchone()
+        return None if row is None else Fraction(row[0])
+
+    def put(self, source: str, target: str, day: str, rate: str) -> None:
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "INSERT OR REPLACE INTO rates VALUES (?, ?, ?, ?, ?)",
+                (source, target, day, rate, time.time()),
+            )
+
+    def invalidate(self, source: str | None = None, target: str | None = None) -> int:
+        """Drop cached rates, optionally only for one currency; returns the count."""
+        sql = "DELETE FROM rates WHERE 1"
+        params = []
+        for column, value in (("source", source), ("target", target)):
+            if value is not None:
+                sql += f" AND {column} = ?"
+                params.append(value)
+        with closing(self._connect()) as db, db:
+            return db.execute(sql, params).rowcount
+
+
+RATE_CACHE = RateCache(CACHE_PATH, CACHE_TTL)
+
+
+def fetch_exchange_rate(source: str, target: str) -> str:
+    """Ask Wise for a quote, returns the rate as decimal text."""
     data = dict(sourceCurrency=source, targetCurrency=target)
     resp = http_request(
         "https://api.transferwise.com/v3/quotes/",
@@ -15,4 +106,230 @@ def exchange_rate(source: str, target: str) -> Fraction:
         data=data,
         headers={"Content-type": "application/json"},
     )
-    return Fraction(resp["rate"])
+    return str(resp["rate"])
+
+
+def quote(source: str, target: str) -> Fraction:
+    """Today's rate for one pair, from the disk cache or from Wise."""
+    day = date.today().isoformat()
+    rate = RATE_CACHE.get(source, target, day)
+    if rate is None:
+        text = fetch_exchange_rate(source, target)
+        RATE_CACHE.put(source, target, day, text)
+        # parse the decimal text of the rate, not the nearest binary float
+        rate = Fraction(text)
+    return rate
+
+
+# (source, target, day) -> (time.monotonic() when fetched, rate)
+CachedRates = dict[tuple[str, str, str], tuple[float, Fraction]]
+
+
+class RateMatrix:
+    """
+    Exchange rates between any two currencies from one quote per currency.
+
+    Every currency is quoted against `base` once, any other pair is derived
+    as (source -> base) / (target -> base). Pairs involving the base currency
+    are direct quotes in the requested direction. If `tolerance` is set,
+    derived rates are compared with a direct quote for the pair and the
+    direct quote is used when they differ by more than this fraction.
+
+    Like the disk cache, rates are kept per day and for at most `ttl`
+    seconds, so a long running process (i.e. harvest-exporter-server) does
+    not keep converting at an old quote.
+    """
+
+    def __init__(
+        self, base: str, tolerance: Fraction | None = None, ttl: float = CACHE_TTL
+    ) -> None:
+        self.base = base
+        self.tolerance = tolerance
+        self.ttl = ttl
+        self._quotes: CachedRates = {}
+        self._checked: CachedRates = {}
+        self._lock = threading.Lock()
+        # one lock per pair, so that concurrent lookups of the same pair
+        # wait for one quote instead of each requesting it
+        self._fetching: dict[tuple[str, str], threading.Lock] = {}
+
+    def _get(self, rates: CachedRates, key: tuple[str, str, str]) -> Fraction | None:
+        with self._lock:
+            cached = rates.get(key)
+        if cached is None or time.monotonic() - cached[0] >= self.ttl:
+            return None
+        return cached[1]
+
+    def _put(
+        self, rates: CachedRates, key: tuple[str, str, str], rate: Fraction
+    ) -> None:
+        with self._lock:
+            # drop the rates of earlier days
+            for old in [k for k in rates if k[2] != key[2]]:
+                del rates[old]
+            rates[key] = (time.monotonic(), rate)
+
+    def _quote(self, source: str, target: str) -> Fraction:
+        key = (source, target, date.today().isoformat())
+        rate = self._get(self._quotes, key)
+        if rate is None:
+            with self._lock:
+                fetching = self._fetching.setdefault((source, target), threading.Lock())
+            with fetching:
+                rate = self._get(self._quotes, key)
+                if rate is None:
+                    rate = quote(source, target)
+                    self._put(self._quotes, key, rate)
+        return rate
+
+    def to_base(self, currency: str) -> Fraction:
+        if currency == self.base:
+            return Fraction(1)
+        return self._quote(currency, self.base)
+
+    def rate(self, source: str, target: str) -> Fraction:
+        if source == target:
+            return Fraction(1)
+        if target == self.base:
+            return self.to_base(source)
+        if source == self.base:
+            # not 1 / to_base(target): the two directions differ by the spread
+            return self._quote(self.base, target)
+        if self.tolerance is None:
+            return self.to_base(source) / self.to_base(target)
+        key = (source, target, date.today().isoformat())
+        rate = self._get(self._checked, key)
+        if rate is None:
+            rate = self._check(source, target)
+            self._put(self._checked, key, rate)
+        return rate
+
+    def _check(self, source: str, target: str) -> Fraction:
+        assert self.tolerance is not None
+        derived = self.to_base(source) / self.to_base(target)
+        direct = quote(source, target)
+        if abs(derived - direct) > self.tolerance * direct:
+            print(
+                f"WARNING, {source}/{target} derived via {self.base} is {float(derived)}, direct quote is {float(direct)}, using the direct quote",
+                file=sys.stderr,
+            )
+            return direct
+        return derived
+
+    def forget(self) -> None:
+        with self._lock:
+            self._quotes.clear()
+            self._checked.clear()
+
+
+RATES = RateMatrix(BASE_CURRENCY, TOLERANCE)
+
+
+def exchange_rate(source: str, target: str) -> Fraction:
+    return RATES.rate(source, target)
+
+
+def fetch_rate_history(
+    source: str, target: str, start: date, end: date
+) -> list[tuple[str, str]]:
+    """Daily rates from Wise's rate history, as (YYYY-MM-DD, decimal text)."""
+    query = urllib.parse.urlencode(
+        {
+            "source": source,
+            "target": target,
+            "from": f"{start.isoformat()}T00:00:00",
+            "to": f"{end.isoformat()}T23:59:59",
+            "group": "day",
+        }
+    )
+    headers = {}
+    token = os.environ.get("WISE_API_TOKEN")
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    # a list of {"rate": ..., "time": "2024-01-31T00:00:00+0000", ...}
+    history: Any = http_request(
+        f"https://api.transferwise.com/v1/rates?{query}", headers=headers
+    )
+    return [(row["time"][:10], str(row["rate"])) for row in history]
+
+
+class RateSeries:
+    """
+    Daily rates of one currency pair, stored as a list indexed by the number
+    of days since `start`. Days without a published rate (i.e. weekends in
+    some sources) use the rate of the day before.
+    """
+
+    # fetched before `start`, so that a range starting on a day without a
+    # rate can be filled from the days before it
+    LOOKBACK = 7
+
+    def __init__(self, start: date, rates: list[Fraction]) -> None:
+        self.start = start
+        self.rates = rates
+
+    @classmethod
+    def fetch(cls, source: str, target: str, start: date, end: date) -> "RateSeries":
+        first = start - timedelta(days=cls.LOOKBACK)
+        by_day = {
+            date.fromisoformat(day): Fraction(text)
+            for day, text in fetch_rate_history(source, target, first, end)
+        }
+        if not by_day:
+            msg = f"No {source}/{target} rates between {first} and {end}"
+            raise ValueError(msg)
+        rates = []
+        rate = by_day[min(by_day)]
+        for offset in range((end - first).days + 1):
+            day = first + timedelta(days=offset)
+            # carry the previous rate forward over days without one
+            rate = by_day.get(day, rate)
+            if day >= start:
+                rates.append(rate)
+        return cls(start, rates)
+
+    def __getitem__(self, day: str | date) -> Fraction:
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        offset = (day - self.start).days
+        if not 0 <= offset < len(self.rates):
+            msg = f"{day} is outside of the rate series starting at {self.start}"
+            raise KeyError(msg)
+        return self.rates[offset]
+
+
+class DailyRates:
+    """
+    Converts into `target` at the rate of the day an amount was spent.
+
+    The whole date range is fetched in one request per source currency, the
+    first time that currency is converted.
+    """
+
+    def __init__(self, target: str, start: date, end: date) -> None:
+        self.target = target
+        self.start = start
+        self.end = end
+        self._series: dict[str, RateSeries] = {}
+        self._lock = threading.Lock()
+
+    def rate(self, source: str, day: str | date) -> Fraction:
+        if source == self.target:
+            return Fraction(1)
+        series = self._series.get(source)
+        if series is None:
+            with self._lock:
+                series = self._series.get(source)
+                if series is None:
+                    series = self._series[source] = RateSeries.fetch(
+                        source, self.target, self.start, self.end
+                    )
+        return series[day]
+
+
+def invalidate_exchange_rates(
+    source: str | None = None, target: str | None = None
+) -> int:
+    """Forget cached rates in this process and on disk, so they are fetched again."""
+    RATES.forget()
+    return RATE_CACHE.invalidate(source, target)
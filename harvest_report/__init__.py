@@ -19,6 +19,8 @@ from string import Template
 from typing import Any
 
 from harvest import get_time_entries
+from harvest.ids import resolve_filters
+from harvest.store import get_time_entries_cached
 
 
 class Error(Exception):
@@ -93,6 +95,17 @@ def parse_args() -> argparse.Namespace:
         type=str,
         help="Project to generate report for",
     )
+    parser.add_argument(
+        "--entry-store",
+        type=Path,
+        default=os.environ.get("HARVEST_ENTRY_STORE"),
+        help="SQLite file to keep time entries in, later runs only download changed entries (env: HARVEST_ENTRY_STORE)",
+    )
+    parser.add_argument(
+        "--full-sync",
+        action="store_true",
+        help="Re-download the whole date range into --entry-store, i.e. to drop deleted entries",
+    )
     parser.add_argument(
         "--format",
         type=str,
@@ -326,9 +339,31 @@ def render_monthly_summary_html(
 
 
 def get_entries(args: argparse.Namespace) -> list[dict[str, Any]]:
-    entries = get_time_entries(
-        args.harvest_account_id, args.harvest_bearer_token, args.start, args.end
-    )
+    if args.entry_store:
+        entries = get_time_entries_cached(
+            args.entry_store,
+            args.harvest_account_id,
+            args.harvest_bearer_token,
+            args.start,
+            args.end,
+            full_sync=args.full_sync,
+            user=args.user,
+            project=args.project,
+        )
+    else:
+        filters = resolve_filters(
+            args.harvest_account_id,
+            args.harvest_bearer_token,
+            user=args.user,
+            project=args.project,
+        )
+        entries = get_time_entries(
+            args.harvest_account_id,
+            args.harvest_bearer_token,
+            args.start,
+            args.end,
+            filters=filters,
+        )
     filtered_entries = []
     for entry in sorted(entries, key=lambda x: x["spent_date"]):
         if args.project and args.project != entry["project"]["name"]:
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import asyncio
 import urllib
 from dataclasses import dataclass
 from datetime import datetime
@@ -11,7 +12,7 @@ from kimai.data import (
     TimeEntryFull,
     UserInfo,
 )
-from rest import http_request2
+from rest import aio, http_request2
 
 
 class KimaiError(Exception):
@@ -47,6 +48,36 @@ class KimaiAPI:
 
         return all_entries
 
+    async def kimai_request_async(
+        self, endpoint: str, data: dict[str, Any]
+    ) -> list[dict[str, Any]]:
+        headers = {
+            "Authorization": f"Bearer {self.access_token}",
+        }
+        url = f"{self.api_url}{endpoint}"
+
+        def collect(resp_json: Any, entries: list[dict[str, Any]]) -> None:
+            if isinstance(resp_json, dict):
+                entries.append(resp_json)
+            else:
+                entries.extend(resp_json)
+
+        all_entries: list[dict[str, Any]] = []
+        resp = await aio.http_request2(url, headers=headers, data={**data, "page": 1})
+        collect(resp.json, all_entries)
+
+        # the first page tells us how many there are, fetch the rest at once
+        total_pages = int(resp.headers.get("X-Total-Pages", 1))
+        pages = await asyncio.gather(
+            *(
+                aio.http_request2(url, headers=headers, data={**data, "page": page})
+                for page in range(2, total_pages + 1)
+            )
+        )
+        for page_resp in pages:
+            collect(page_resp.json, all_entries)
+        return all_entries
+
     def get_visible_projects(self, billable: bool = False) -> list[dict[str, Any]]:
         endpoint = "/api/projects"
         data = {
@@ -104,3 +135,48 @@ class KimaiAPI:
         endpoint = f"/api/timesheets/{entry_id}"
         entry_data = self.kimai_request(endpoint, {})
         return TimeEntryFull.from_json(entry_data[0])
+
+    async def get_visible_projects_async(self) -> list[dict[str, Any]]:
+        return await self.kimai_request_async("/api/projects", {"visible": 1})
+
+    async def get_visible_users_async(self) -> list[dict[str, Any]]:
+        return await self.kimai_request_async("/api/users", {"visible": 1})
+
+    async def get_customer_async(self, customer_id: int) -> CustomerInfo:
+        data = await self.kimai_request_async(f"/api/customers/{customer_id}", {})
+        return CustomerInfo.from_json(data[0])
+
+    async def get_user_async(self, user_id: int) -> UserInfo:
+        data = await self.kimai_request_async(f"/api/users/{user_id}", {})
+        return UserInfo.from_json(data[0])
+
+    async def get_activity_async(self, activity_id: int) -> ActivityInfo:
+        data = await self.kimai_request_async(f"/api/activities/{activity_id}", {})
+        return ActivityInfo.from_json(data[0])
+
+    async def get_time_entries_async(
+        self,
+        from_date: datetime,
+        to_date: datetime,
+        user_id: int,
+        customer_id: int,
+        project_id: int,
+        billable: bool = True,
+    ) -> list[dict[str, Any]]:
+        data = {
+            "user": user_id,
+            "customer": customer_id,
+            "project": project_id,
+            "begin": from_date.strftime("%Y-%m-%dT%H:%M:%S"),
+            "end": to_date.strftime("%Y-%m-%dT%H:%M:%S"),
+            "billable": int(billable),
+        }
+        try:
+            return await self.kimai_request_async("/api/timesheets", data)
+        except urllib.error.HTTPError as e:
+            msg = f"Failed to get time entries: {data}"
+            raise KimaiError(msg) from e
+
+    async def get_time_entry_async(self, entry_id: int) -> TimeEntryFull:
+        data = await self.kimai_request_async(f"/api/timesheets/{entry_id}", {})
+        return TimeEntryFull.from_json(data[0])
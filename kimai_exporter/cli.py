@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 import calendar
 import json
 import os
@@ -12,7 +13,14 @@ from fractions import Fraction
 import kimai
 import kimai.api
 from harvest_exporter.transferwise import exchange_rate as get_exchange_rate
-from kimai.data import JsonSerializable, ProjectInfo, TimeEntry, UserInfo
+from harvest_exporter.transferwise import invalidate_exchange_rates
+from kimai.data import (
+    CustomerInfo,
+    JsonSerializable,
+    ProjectInfo,
+    TimeEntry,
+    UserInfo,
+)
 from kimai.jsonserializer import JsonEncoder
 
 from . import ProjectReport
@@ -93,6 +101,11 @@ def parse_args() -> argparse.Namespace:
         type=str,
         help="Target currency to convert to, i.e EUR",
     )
+    parser.add_argument(
+        "--refresh-rates",
+        action="store_true",
+        help="Drop cached exchange rates and fetch new quotes",
+    )
     args = parser.parse_args()
     today = datetime.today()
     if args.month and (args.start or args.end):
@@ -156,10 +169,18 @@ def generate_report(options: ReportOptions) -> None:
         raise Error(msg)
     user = UserInfo.from_json(users_data[0])
 
+    # look up all customers concurrently instead of one round trip per project
+    project_infos = [ProjectInfo.from_json(p) for p in projects]
+
+    async def get_customers() -> list[CustomerInfo]:
+        return await asyncio.gather(
+            *(api.get_customer_async(p.customer) for p in project_infos)
+        )
+
+    customers = asyncio.run(get_customers())
+
     all_reports: list[ProjectReport] = []
-    for project_data in projects:
-        project = ProjectInfo.from_json(project_data)
-        customer = api.get_customer(project.customer)
+    for project, customer in zip(project_infos, customers, strict=True):
         print(
             f"Project name: {project.name}. Customer name: {customer.name}",
             file=sys.stderr,
@@ -235,6 +256,8 @@ def generate_report(options: ReportOptions) -> None:
 
 def main() -> None:
     args = parse_args()
+    if args.refresh_rates:
+        invalidate_exchange_rates()
     options = ReportOptions(
         kimai_api_key=args.kimai_api_key,
         api_url=args.api_url,
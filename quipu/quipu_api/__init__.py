@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import atexit
 import base64
 import logging
 from dataclasses import dataclass, field
@@ -8,6 +9,53 @@ from typing import Any
 from urllib.parse import urljoin
 
 import requests
+from requests.structures import CaseInsensitiveDict
+
+from .cassette import from_env as cassette_from_env
+
+CASSETTE = cassette_from_env()
+if CASSETTE is not None and not CASSETTE.replaying:
+    atexit.register(CASSETTE.save)
+
+
+def _request(method: str, url: str, **kwargs: Any) -> requests.Response:
+    """requests.request() that records to / replays from REST_CASSETTE."""
+    if CASSETTE is None:
+        return requests.request(method, url, **kwargs)
+
+    prepared = requests.Request(
+        method,
+        url,
+        headers=kwargs.get("headers"),
+        data=kwargs.get("data"),
+        json=kwargs.get("json"),
+        params=kwargs.get("params"),
+    ).prepare()
+    assert prepared.url is not None
+    body = prepared.body.encode() if isinstance(prepared.body, str) else prepared.body
+    if CASSETTE.replaying:
+        recorded = CASSETTE.replay(method, prepared.url, body)
+        response = requests.Response()
+        response.status_code = recorded.status
+        response.reason = recorded.reason
+        response.headers = CaseInsensitiveDict(dict(recorded.headers))
+        response._content = recorded.body  # noqa: SLF001
+        response.url = prepared.url
+        response.request = prepared
+        return response
+
+    response = requests.request(method, url, **kwargs)
+    CASSETTE.record(
+        method,
+        prepared.url,
+        body,
+        response.status_code,
+        response.reason,
+        list(response.headers.items()),
+        response.content,
+        response.elapsed.total_seconds(),
+    )
+    return response
 
 
 @dataclass
@@ -66,7 +114,8 @@ class QuipuAPI:
             {"Content-Type": "application/x-www-form-urlencoded;charset=UTF-8"}
         )
         try:
-            response = requests.post(
+            response = _request(
+                "POST",
                 token_endpoint,
                 headers=headers,
                 data={"scope": "ecommerce", "grant_type": "client_credentials"},
@@ -104,7 +153,7 @@ class QuipuAPI:
         while attempts < max_retries:
             response = None
             try:
-                response = requests.request(
+                response = _request(
                     method,
                     url,
                     headers=self._headers,
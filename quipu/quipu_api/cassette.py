@@ -0,0 +1,98 @@
+# A minimal version of rest/cassette.py for the quipu API client, which is
+# packaged on its own and cannot import rest. It reads and writes the same
+# cassette files; REST_REPLAY_LATENCY is only supported by rest.
+import base64
+import json
+import os
+from pathlib import Path
+from typing import Any, NamedTuple
+
+
+class CassetteError(Exception):
+    pass
+
+
+class Recorded(NamedTuple):
+    status: int
+    reason: str
+    headers: list[tuple[str, str]]
+    body: bytes
+
+
+def _decode(body: bytes | None) -> str | None:
+    return body.decode("utf-8", "replace") if body is not None else None
+
+
+class Cassette:
+    """
+    Recorded HTTP interactions, in the file format of rest/cassette.py.
+
+    Identical requests are replayed in recorded order, the last response is
+    kept for requests repeated more often than during recording.
+    """
+
+    def __init__(self, path: Path, mode: str) -> None:
+        if mode not in ("record", "replay"):
+            msg = f"unknown cassette mode {mode}, expected record or replay"
+            raise CassetteError(msg)
+        self.path = path
+        self.replaying = mode == "replay"
+        self.interactions: list[dict[str, Any]] = (
+            json.loads(path.read_text()) if self.replaying else []
+        )
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        request_body: bytes | None,
+        status: int,
+        reason: str,
+        headers: list[tuple[str, str]],
+        body: bytes,
+        seconds: float,
+    ) -> None:
+        self.interactions.append(
+            {
+                "method": method,
+                "url": url,
+                "request_body": _decode(request_body),
+                "status": status,
+                "reason": reason,
+                "headers": headers,
+                "body": base64.b64encode(body).decode("ascii"),
+                "seconds": seconds,
+            }
+        )
+
+    def replay(self, method: str, url: str, request_body: bytes | None) -> Recorded:
+        key = (method, url, _decode(request_body))
+        matches = [
+            i
+            for i, data in enumerate(self.interactions)
+            if (data["method"], data["url"], data["request_body"]) == key
+        ]
+        if not matches:
+            msg = f"no recorded response for {method} {url} in {self.path}"
+            raise CassetteError(msg)
+        if len(matches) > 1:
+            data = self.interactions.pop(matches[0])
+        else:
+            data = self.interactions[matches[0]]
+        return Recorded(
+            data["status"],
+            data["reason"],
+            [(name, value) for name, value in data["headers"]],
+            base64.b64decode(data["body"]),
+        )
+
+    def save(self) -> None:
+        self.path.write_text(json.dumps(self.interactions, indent=1))
+
+
+def from_env() -> Cassette | None:
+    """REST_CASSETTE: cassette file, REST_CASSETTE_MODE: record or replay."""
+    path = os.environ.get("REST_CASSETTE")
+    if not path:
+        return None
+    return Cassette(Path(path), os.environ.get("REST_CASSETTE_MODE", "replay"))
@@ -1,9 +1,298 @@
+import atexit
+import gzip
+import io
 import json
+import os
+import sys
+import time
+import urllib.error
 import urllib.parse
-import urllib.request
 from dataclasses import dataclass
+from email.message import Message
+from pathlib import Path
 from typing import Any
 
+from .cache import CacheStats, HttpCache
+from .cassette import from_env as cassette_from_env
+from .metrics import REGISTRY
+from .pool import (
+    POOL,
+    STALE_CONNECTION_ERRORS,
+    PoolStats,
+    proxy_authorization,
+    proxy_for,
+)
+from .ratelimit import backoff, limiter_for, retry_after
+from .ratelimit import set_rate_limit as set_rate_limit
+
+USER_AGENT = "Numtide invoice generator"
+MAX_REDIRECTS = 5
+MAX_RETRIES = 5
+
+
+@dataclass
+class RawResponse:
+    status: int
+    reason: str
+    headers: Message
+    body: bytes
+    url: str
+    reused: bool = False
+    retries: int = 0
+
+
+def _open_connection(
+    url: str, method: str, headers: dict[str, str], body: bytes | None
+) -> RawResponse:
+    parsed = urllib.parse.urlsplit(url)
+    assert parsed.hostname is not None, f"invalid url: {url}"
+    path = parsed.path or "/"
+    if parsed.query:
+        path += "?" + parsed.query
+    headers = {**headers, "Accept-Encoding": "gzip"}
+    if parsed.scheme == "http":
+        proxy = proxy_for(parsed.scheme, parsed.hostname)
+        if proxy is not None:
+            # plain HTTP proxies want the absolute URL, HTTPS is tunneled
+            path = url
+            headers.update(proxy_authorization(proxy))
+
+    conn, reused = POOL.acquire(parsed.scheme, parsed.hostname, parsed.port)
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        data = resp.read()
+    except STALE_CONNECTION_ERRORS:
+        conn.close()
+        if not reused:
+            raise
+        # The server dropped the idle connection, retry once on a fresh one.
+        conn, reused = POOL.acquire(parsed.scheme, parsed.hostname, parsed.port)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        except BaseException:
+            conn.close()
+            raise
+    except BaseException:
+        conn.close()
+        raise
+
+    if resp.will_close:
+        conn.close()
+    else:
+        POOL.release(parsed.scheme, parsed.hostname, parsed.port, conn)
+    if resp.headers.get("Content-Encoding") == "gzip":
+        data = gzip.decompress(data)
+        del resp.headers["Content-Encoding"]
+    return RawResponse(
+        status=resp.status,
+        reason=resp.reason,
+        headers=resp.headers,
+        body=data,
+        url=url,
+        reused=reused,
+    )
+
+
+CASSETTE = cassette_from_env()
+if CASSETTE is not None and not CASSETTE.replaying:
+    atexit.register(CASSETTE.save)
+
+
+def _open(
+    url: str, method: str, headers: dict[str, str], body: bytes | None
+) -> RawResponse:
+    if CASSETTE is not None and CASSETTE.replaying:
+        recorded = CASSETTE.replay(method, url, body)
+        message = Message()
+        for name, value in recorded.headers:
+            message[name] = value
+        return RawResponse(
+            recorded.status, recorded.reason, message, recorded.body, url
+        )
+    # only requests that reach the network take from the rate limit budget,
+    # fresh cache hits and replayed cassettes do not
+    limiter = limiter_for(urllib.parse.urlsplit(url).hostname or "", headers)
+    if limiter is not None:
+        limiter.acquire()
+    start = time.monotonic()
+    resp = _open_connection(url, method, headers, body)
+    if CASSETTE is not None:
+        CASSETTE.record(
+            method,
+            url,
+            body,
+            resp.status,
+            resp.reason,
+            list(resp.headers.items()),
+            resp.body,
+            time.monotonic() - start,
+        )
+    return resp
+
+
+_cache: HttpCache | None = None
+
+
+def enable_cache(directory: Path) -> None:
+    """Cache GET responses on disk and revalidate them with conditional requests."""
+    global _cache  # noqa: PLW0603
+    _cache = HttpCache(directory)
+
+
+def cache_stats() -> CacheStats | None:
+    return _cache.stats if _cache else None
+
+
+def _fetch(
+    url: str, method: str, headers: dict[str, str], body: bytes | None
+) -> RawResponse:
+    cache = _cache
+    if cache is None or method != "GET":
+        return _open(url, method, headers, body)
+
+    key = cache.key(method, url, headers)
+    entry = cache.lookup(key)
+    if entry is not None and entry.fresh:
+        cache.count("hits", len(entry.body))
+        return RawResponse(entry.status, "OK", entry.message(), entry.body, url)
+
+    conditional = headers.copy()
+    if entry is not None and entry.etag:
+        conditional["If-None-Match"] = entry.etag
+    if entry is not None and entry.last_modified:
+        conditional["If-Modified-Since"] = entry.last_modified
+    resp = _open(url, method, conditional, body)
+
+    if resp.status == 304 and entry is not None:
+        cache.refresh(key, entry, resp.headers)
+        cache.count("revalidations", len(entry.body))
+        return RawResponse(entry.status, "OK", entry.message(), entry.body, url)
+    cache.count("misses")
+    if resp.status == 200:
+        cache.store(key, resp.status, resp.headers, resp.body)
+    return resp
+
+
+if os.environ.get("REST_CACHE_DIR"):
+    enable_cache(Path(os.environ["REST_CACHE_DIR"]))
+
+
+def _throttled(
+    url: str, method: str, headers: dict[str, str], body: bytes | None
+) -> RawResponse:
+    """Retry on 429 / 503, blocking the host's rate limit budget meanwhile."""
+    host = urllib.parse.urlsplit(url).hostname or ""
+    limiter = limiter_for(host, headers)
+    if CASSETTE is not None and CASSETTE.replaying:
+        limiter = None
+    for attempt in range(MAX_RETRIES + 1):
+        resp = _fetch(url, method, headers, body)
+        resp.retries = attempt
+        if resp.status not in (429, 503) or attempt == MAX_RETRIES:
+            return resp
+        wait = retry_after(resp.headers.get("Retry-After"))
+        if wait is None:
+            wait = backoff(attempt)
+        print(
+            f"{method} {url}: got {resp.status}, retrying in {wait:.1f}s",
+            file=sys.stderr,
+        )
+        if limiter is not None:
+            # let every process sharing the budget back off, not just us
+            limiter.block(wait)
+        else:
+            time.sleep(wait)
+    return resp
+
+
+def _send_uninstrumented(
+    url: str, method: str, headers: dict[str, str], body: bytes | None
+) -> RawResponse:
+    """
+    Send a request over a pooled keep-alive connection.
+
+    Mirrors urllib.request.urlopen: redirects are followed and error statuses
+    raise urllib.error.HTTPError so callers can keep catching that.
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        resp = _throttled(url, method, headers, body)
+        location = resp.headers.get("Location")
+        if resp.status in (301, 302, 303, 307, 308) and location:
+            url = urllib.parse.urljoin(url, location)
+            if resp.status == 303 or (resp.status in (301, 302) and method == "POST"):
+                method = "GET"
+                body = None
+            continue
+        if resp.status >= 400:
+            raise urllib.error.HTTPError(
+                url, resp.status, resp.reason, resp.headers, io.BytesIO(resp.body)
+            )
+        return resp
+    raise urllib.error.HTTPError(
+        url, resp.status, "too many redirects", resp.headers, io.BytesIO(resp.body)
+    )
+
+
+def _send(
+    url: str, method: str, headers: dict[str, str], body: bytes | None
+) -> RawResponse:
+    start = time.monotonic()
+    status, size, retries, reused = 0, 0, 0, False
+    try:
+        resp = _send_uninstrumented(url, method, headers, body)
+        status, size, retries, reused = (
+            resp.status,
+            len(resp.body),
+            resp.retries,
+            resp.reused,
+        )
+    except urllib.error.HTTPError as e:
+        status = e.code
+        raise
+    finally:
+        REGISTRY.record(
+            method, url, status, time.monotonic() - start, size, retries, reused
+        )
+    return resp
+
+
+def pool_stats() -> PoolStats:
+    return POOL.stats
+
+
+def _print_stats() -> None:
+    stats = POOL.stats
+    print(
+        f"http: {stats.requests} requests, {stats.connections_opened} connections opened, "
+        f"{stats.connections_reused} reused ({stats.reuse_ratio:.0%})",
+        file=sys.stderr,
+    )
+    if _cache is not None:
+        c = _cache.stats
+        print(
+            f"http cache: {c.hits} hits, {c.revalidations} revalidated, {c.misses} misses, "
+            f"{c.bytes_saved} bytes saved",
+            file=sys.stderr,
+        )
+
+
+def _dump_metrics() -> None:
+    target = os.environ.get("REST_METRICS", "-")
+    if target == "-":
+        REGISTRY.dump(sys.stderr)
+    else:
+        with Path(target).open("w") as f:
+            REGISTRY.dump(f)
+
+
+if os.environ.get("REST_STATS"):
+    atexit.register(_print_stats)
+if os.environ.get("REST_METRICS"):
+    atexit.register(_dump_metrics)
+
 
 def http_request(
     url: str,
@@ -17,10 +306,9 @@ def http_request(
     if data:
         body = json.dumps(data).encode("ascii")
     headers = headers.copy()
-    headers["User-Agent"] = "Numtide invoice generator"
-    req = urllib.request.Request(url, headers=headers, method=method, data=body)
-    resp = urllib.request.urlopen(req)
-    return json.load(resp)
+    headers["User-Agent"] = USER_AGENT
+    resp = _send(url, method, headers, body)
+    return json.loads(resp.body)
 
 
 @dataclass
@@ -45,11 +333,10 @@ def http_request2(
         body = json.dumps(data).encode("ascii") if data else None
 
     headers = headers.copy()
-    headers["User-Agent"] = "Numtide invoice generator"
-    req = urllib.request.Request(url, headers=headers, method=method, data=body)
-    resp = urllib.request.urlopen(req)
+    headers["User-Agent"] = USER_AGENT
+    resp = _send(url, method, headers, body)
     return Response(
         status=resp.status,
         headers=dict(resp.headers),
-        json=json.load(resp),
+        json=json.loads(resp.body),
     )
@@ -0,0 +1,30 @@
+# asyncio counterparts of rest.http_request / rest.http_request2.
+#
+# Requests run on the default executor through the same code path as the
+# synchronous functions, so they share the connection pool, cache, rate
+# limits and error types (urllib.error.HTTPError) with them.
+
+import asyncio
+from typing import Any
+
+from . import Response
+from . import http_request as sync_http_request
+from . import http_request2 as sync_http_request2
+
+
+async def http_request(
+    url: str,
+    method: str = "GET",
+    headers: dict[str, str] | None = None,
+    data: dict[str, Any] | None = None,
+) -> dict[str, Any]:
+    return await asyncio.to_thread(sync_http_request, url, method, headers, data)
+
+
+async def http_request2(
+    url: str,
+    method: str = "GET",
+    headers: dict[str, str] | None = None,
+    data: dict[str, Any] | None = None,
+) -> Response:
+    return await asyncio.to_thread(sync_http_request2, url, method, headers, data)
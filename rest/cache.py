@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from email.message import Message
+from pathlib import Path
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    revalidations: int = 0
+    bytes_saved: int = 0
+
+
+@dataclass
+class CacheEntry:
+    status: int
+    headers: list[tuple[str, str]]
+    body: bytes
+    stored_at: float
+    etag: str | None = None
+    last_modified: str | None = None
+    max_age: int | None = None
+
+    @property
+    def fresh(self) -> bool:
+        return self.max_age is not None and time.time() - self.stored_at < self.max_age
+
+    def message(self) -> Message:
+        msg = Message()
+        for name, value in self.headers:
+            msg[name] = value
+        return msg
+
+
+def max_age(cache_control: str | None) -> int | None:
+    if not cache_control:
+        return None
+    m = re.search(r"max-age=(\d+)", cache_control)
+    return int(m.group(1)) if m else None
+
+
+@dataclass
+class HttpCache:
+    """
+    On-disk cache for GET responses that come with ETag / Last-Modified.
+
+    Entries are revalidated with If-None-Match / If-Modified-Since, so the
+    server still decides whether our copy is current, a 304 just saves the
+    body transfer. Responses with a max-age are served without asking.
+    """
+
+    directory: Path
+    stats: CacheStats = field(default_factory=CacheStats)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def key(self, method: str, url: str, headers: dict[str, str]) -> str:
+        # the authorization headers are part of the key, so that different
+        # accounts never see each other's responses
+        data = json.dumps([method, url, sorted(headers.items())])
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / key
+
+    def lookup(self, key: str) -> CacheEntry | None:
+        path = self._path(key)
+        try:
+            meta = json.loads(path.with_suffix(".json").read_text())
+            body = path.with_suffix(".body").read_bytes()
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(
+            status=meta["status"],
+            headers=[tuple(h) for h in meta["headers"]],
+            body=body,
+            stored_at=meta["stored_at"],
+            etag=meta.get("etag"),
+            last_modified=meta.get("last_modified"),
+            max_age=meta.get("max_age"),
+        )
+
+    def store(self, key: str, status: int, headers: Message, body: bytes) -> None:
+        cache_control = headers.get("Cache-Control", "")
+        if "no-store" in cache_control:
+            return
+        entry = CacheEntry(
+            status=status,
+            headers=list(headers.items()),
+            body=body,
+            stored_at=time.time(),
+            etag=headers.get("ETag"),
+            last_modified=headers.get("Last-Modified"),
+            max_age=max_age(cache_control),
+        )
+        if entry.etag is None and entry.last_modified is None and not entry.max_age:
+            return
+        self._write(key, entry)
+
+    def refresh(self, key: str, entry: CacheEntry, headers: Message) -> None:
+        """Update validators and freshness after a 304 Not Modified."""
+        entry.stored_at = time.time()
+        entry.etag = headers.get("ETag", entry.etag)
+        entry.last_modified = headers.get("Last-Modified", entry.last_modified)
+        entry.max_age = max_age(headers.get("Cache-Control")) or entry.max_age
+        self._write(key, entry)
+
+    def _write(self, key: str, entry: CacheEntry) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        meta = dict(
+            status=entry.status,
+            headers=entry.headers,
+            stored_at=entry.stored_at,
+            etag=entry.etag,
+            last_modified=entry.last_modified,
+            max_age=entry.max_age,
+        )
+        # write body first and replace atomically, so that concurrent
+        # processes never read a half written entry
+        for suffix, data in (
+            (".body", entry.body),
+            (".json", json.dumps(meta).encode()),
+        ):
+            fd, tmp = tempfile.mkstemp(dir=path.parent)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            Path(tmp).replace(path.with_suffix(suffix))
+
+    def count(self, stat: str, saved: int = 0) -> None:
+        with self._lock:
+            setattr(self.stats, stat, getattr(self.stats, stat) + 1)
+            self.stats.bytes_saved += saved
@@ -0,0 +1,127 @@
+import base64
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+
+class CassetteError(Exception):
+    pass
+
+
+@dataclass
+class Interaction:
+    method: str
+    url: str
+    request_body: str | None
+    status: int
+    reason: str
+    headers: list[tuple[str, str]]
+    body: bytes
+    seconds: float
+
+    def to_json(self) -> dict[str, Any]:
+        data = asdict(self)
+        data["body"] = base64.b64encode(self.body).decode("ascii")
+        return data
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> "Interaction":
+        data = data.copy()
+        data["body"] = base64.b64decode(data["body"])
+        data["headers"] = [tuple(h) for h in data["headers"]]
+        return cls(**data)
+
+
+def _decode(body: bytes | None) -> str | None:
+    return body.decode("utf-8", "replace") if body is not None else None
+
+
+class Cassette:
+    """
+    Recorded HTTP interactions for offline runs.
+
+    In "record" mode every response is kept and written to `path` on exit.
+    In "replay" mode requests are answered from the file, matched by method,
+    URL and request body; identical requests are replayed in recorded order.
+    Request headers are never stored, response bodies are stored as is, so
+    treat cassettes like the account data they contain.
+    """
+
+    def __init__(self, path: Path, mode: str, latency: str | None = None) -> None:
+        if mode not in ("record", "replay"):
+            msg = f"unknown cassette mode {mode}, expected record or replay"
+            raise CassetteError(msg)
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.interactions: list[Interaction] = []
+        self._replay: dict[tuple[str, str, str | None], deque[Interaction]]
+        self._replay = defaultdict(deque)
+        self._lock = threading.Lock()
+        if mode == "replay":
+            for data in json.loads(path.read_text()):
+                interaction = Interaction.from_json(data)
+                key = (interaction.method, interaction.url, interaction.request_body)
+                self._replay[key].append(interaction)
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        request_body: bytes | None,
+        status: int,
+        reason: str,
+        headers: list[tuple[str, str]],
+        body: bytes,
+        seconds: float,
+    ) -> None:
+        interaction = Interaction(
+            method, url, _decode(request_body), status, reason, headers, body, seconds
+        )
+        with self._lock:
+            self.interactions.append(interaction)
+
+    def replay(self, method: str, url: str, request_body: bytes | None) -> Interaction:
+        key = (method, url, _decode(request_body))
+        with self._lock:
+            recorded = self._replay.get(key)
+            if not recorded:
+                msg = f"no recorded response for {method} {url} in {self.path}"
+                raise CassetteError(msg)
+            # keep the last response around for requests repeated more often
+            # than during recording
+            interaction = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        if self.latency == "recorded":
+            time.sleep(interaction.seconds)
+        elif self.latency:
+            time.sleep(float(self.latency))
+        return interaction
+
+    def save(self) -> None:
+        with self._lock:
+            data = [i.to_json() for i in self.interactions]
+        self.path.write_text(json.dumps(data, indent=1))
+
+
+def from_env() -> Cassette | None:
+    """
+    REST_CASSETTE: cassette file, REST_CASSETTE_MODE: record or replay,
+    REST_REPLAY_LATENCY: seconds to sleep per replayed request or "recorded".
+    """
+    path = os.environ.get("REST_CASSETTE")
+    if not path:
+        return None
+    return Cassette(
+        Path(path),
+        os.environ.get("REST_CASSETTE_MODE", "replay"),
+        os.environ.get("REST_REPLAY_LATENCY"),
+    )
@@ -0,0 +1,79 @@
+import json
+import re
+import threading
+import urllib.parse
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from typing import Any, TextIO
+
+# numeric ids, uuids and hex hashes are collapsed into one template
+ID_SEGMENT = re.compile(r"^(\d+|[0-9a-f]{8}-[0-9a-f-]{27}|[0-9a-f]{32,})$", re.I)
+
+
+def path_template(url: str) -> tuple[str, str]:
+    """Map https://host/api/activities/42?page=2 to ("host", "/api/activities/{id}")."""
+    parsed = urllib.parse.urlsplit(url)
+    segments = [
+        "{id}" if ID_SEGMENT.match(segment) else segment
+        for segment in parsed.path.split("/")
+    ]
+    return parsed.hostname or "", "/".join(segments) or "/"
+
+
+@dataclass
+class EndpointMetrics:
+    calls: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+    response_bytes: int = 0
+    retries: int = 0
+    reused_connections: int = 0
+    statuses: dict[int, int] = field(default_factory=dict)
+
+
+class Registry:
+    """Per endpoint request statistics for the lifetime of the process."""
+
+    def __init__(self) -> None:
+        self.endpoints: dict[tuple[str, str, str], EndpointMetrics] = defaultdict(
+            EndpointMetrics
+        )
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        method: str,
+        url: str,
+        status: int,
+        seconds: float,
+        response_bytes: int,
+        retries: int,
+        reused: bool,
+    ) -> None:
+        host, template = path_template(url)
+        with self._lock:
+            m = self.endpoints[(method, host, template)]
+            m.calls += 1
+            m.seconds += seconds
+            m.max_seconds = max(m.max_seconds, seconds)
+            m.response_bytes += response_bytes
+            m.retries += retries
+            m.reused_connections += reused
+            m.statuses[status] = m.statuses.get(status, 0) + 1
+
+    def to_json(self) -> list[dict[str, Any]]:
+        with self._lock:
+            items = sorted(
+                self.endpoints.items(), key=lambda item: item[1].seconds, reverse=True
+            )
+            return [
+                dict(method=method, host=host, path=path, **asdict(m))
+                for (method, host, path), m in items
+            ]
+
+    def dump(self, out: TextIO) -> None:
+        json.dump(self.to_json(), out, indent=2)
+        out.write("\n")
+
+
+REGISTRY = Registry()
@@ -0,0 +1,124 @@
+import base64
+import http.client
+import threading
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass
+
+# Errors that indicate the server closed an idle keep-alive connection
+# before we reused it. The request is safe to retry on a fresh connection.
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+    ConnectionAbortedError,
+)
+
+
+@dataclass
+class PoolStats:
+    requests: int = 0
+    connections_opened: int = 0
+    connections_reused: int = 0
+
+    @property
+    def reuse_ratio(self) -> float:
+        if self.requests == 0:
+            return 0.0
+        return self.connections_reused / self.requests
+
+
+def proxy_for(scheme: str, host: str) -> urllib.parse.SplitResult | None:
+    """The proxy from http(s)_proxy / no_proxy for this host, like urlopen."""
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(host):
+        return None
+    if "://" not in proxy:
+        proxy = f"http://{proxy}"
+    return urllib.parse.urlsplit(proxy)
+
+
+def proxy_authorization(proxy: urllib.parse.SplitResult) -> dict[str, str]:
+    if proxy.username is None:
+        return {}
+    userinfo = urllib.parse.unquote(proxy.username)
+    if proxy.password is not None:
+        userinfo += ":" + urllib.parse.unquote(proxy.password)
+    token = base64.b64encode(userinfo.encode()).decode("ascii")
+    return {"Proxy-Authorization": f"Basic {token}"}
+
+
+class ConnectionPool:
+    """
+    Keeps idle keep-alive connections per (scheme, host, port), so repeated
+    requests to Harvest, Kimai or Transferwise skip the TCP and TLS handshake.
+
+    HTTPS requests go through a CONNECT tunnel if https_proxy is set, plain
+    HTTP connections are opened to http_proxy instead of the host; callers
+    then have to send the absolute URL as the request target.
+    """
+
+    def __init__(self, max_idle_per_host: int = 8, timeout: float = 60) -> None:
+        self.max_idle_per_host = max_idle_per_host
+        self.timeout = timeout
+        self.stats = PoolStats()
+        self._idle: dict[tuple[str, str, int | None], list[http.client.HTTPConnection]]
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(
+        self, scheme: str, host: str, port: int | None
+    ) -> tuple[http.client.HTTPConnection, bool]:
+        """Return a connection and whether it was reused from the pool."""
+        key = (scheme, host, port)
+        with self._lock:
+            self.stats.requests += 1
+            idle = self._idle.get(key)
+            if idle:
+                self.stats.connections_reused += 1
+                return idle.pop(), True
+            self.stats.connections_opened += 1
+        conn: http.client.HTTPConnection
+        proxy = proxy_for(scheme, host)
+        if proxy is not None and proxy.hostname is not None:
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(
+                    proxy.hostname, proxy.port, timeout=self.timeout
+                )
+                conn.set_tunnel(host, port, headers=proxy_authorization(proxy))
+            else:
+                conn = http.client.HTTPConnection(
+                    proxy.hostname, proxy.port, timeout=self.timeout
+                )
+        elif scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.timeout)
+        return conn, False
+
+    def release(
+        self,
+        scheme: str,
+        host: str,
+        port: int | None,
+        conn: http.client.HTTPConnection,
+    ) -> None:
+        key = (scheme, host, port)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+POOL = ConnectionPool()
@@ -0,0 +1,142 @@
+import fcntl
+import hashlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections.abc import Callable, Mapping
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
+# (now, tokens, blocked_until) -> (tokens, blocked_until, seconds to wait)
+TokenUpdate = Callable[[float, float, float], tuple[float, float, float]]
+
+
+def retry_after(value: str | None) -> float | None:
+    """Parse a Retry-After header, which is either seconds or an HTTP date."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2**attempt))  # noqa: S311
+
+
+class RateLimiter:
+    """
+    Token bucket for one host (or one access token of it), shared by all
+    processes on this machine.
+
+    The bucket lives in a small JSON file guarded by flock(), so parallel
+    cron runs draw from the same budget instead of each assuming the full
+    limit for themselves. A 429 blocks the bucket for everyone until the
+    server's Retry-After has passed.
+    """
+
+    def __init__(self, path: Path, requests: int, period: float) -> None:
+        self.path = path
+        self.capacity = float(requests)
+        self.rate = requests / period
+
+    def _update(self, fn: TokenUpdate) -> float:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state = json.loads(f.read())
+            except ValueError:
+                state = {}
+            now = time.time()
+            tokens = state.get("tokens", self.capacity)
+            updated = state.get("updated", now)
+            tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+            blocked_until = state.get("blocked_until", 0.0)
+            tokens, blocked_until, wait = fn(now, tokens, blocked_until)
+            f.seek(0)
+            f.truncate()
+            f.write(
+                json.dumps(
+                    dict(tokens=tokens, updated=now, blocked_until=blocked_until)
+                )
+            )
+            return wait
+
+    def acquire(self) -> None:
+        def take(
+            now: float, tokens: float, blocked_until: float
+        ) -> tuple[float, float, float]:
+            if now < blocked_until:
+                return tokens, blocked_until, blocked_until - now
+            if tokens >= 1:
+                return tokens - 1, blocked_until, 0.0
+            return tokens, blocked_until, (1 - tokens) / self.rate
+
+        while True:
+            wait = self._update(take)
+            if wait <= 0:
+                return
+            # jitter, so that waiting processes do not wake up in lockstep
+            time.sleep(wait + random.uniform(0, 0.1 * wait))  # noqa: S311
+
+    def block(self, seconds: float) -> None:
+        def until(
+            now: float, tokens: float, blocked_until: float
+        ) -> tuple[float, float, float]:
+            return 0.0, max(blocked_until, now + seconds), 0.0
+
+        self._update(until)
+
+
+STATE_DIR = Path(
+    os.environ.get(
+        "REST_RATELIMIT_DIR",
+        Path(tempfile.gettempdir()) / f"numtide-invoice-ratelimit-{os.getuid()}",
+    )
+)
+# host -> (requests, period, header whose value gets its own bucket)
+LIMITS: dict[str, tuple[int, float, str | None]] = {}
+LIMITERS: dict[tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def set_rate_limit(
+    host: str, requests: int, period: float, per_header: str | None = None
+) -> None:
+    """
+    Limit requests to host. With `per_header`, i.e. "Authorization" for APIs
+    that limit per access token, every value of that header has its own
+    budget.
+    """
+    LIMITS[host] = (requests, period, per_header and per_header.lower())
+
+
+def limiter_for(host: str, headers: Mapping[str, str]) -> RateLimiter | None:
+    limit = LIMITS.get(host)
+    if limit is None:
+        return None
+    requests, period, per_header = limit
+    key = ""
+    if per_header is not None:
+        value = next((v for k, v in headers.items() if k.lower() == per_header), "")
+        # the state file name must not contain the token itself
+        key = hashlib.sha256(value.encode()).hexdigest()[:16] if value else ""
+    with _limiters_lock:
+        limiter = LIMITERS.get((host, key))
+        if limiter is None:
+            name = f"{host}-{key}.json" if key else f"{host}.json"
+            limiter = LIMITERS[(host, key)] = RateLimiter(
+                STATE_DIR / name, requests, period
+            )
+    return limiter
@@ -2,20 +2,30 @@
 from __future__ import annotations
 
 import argparse
+import atexit
 import base64
 import calendar
+import io
 import json
 import os
 import sys
+import time
 import urllib.error
 import urllib.request
 from datetime import date, datetime, timedelta
+from email.message import Message
 from typing import Any, NoReturn
 
 import rsa
 
+from .cassette import from_env as cassette_from_env
+
 BASE_URL = " https://api.transferwise.com"
 
+CASSETTE = cassette_from_env()
+if CASSETTE is not None and not CASSETTE.replaying:
+    atexit.register(CASSETTE.save)
+
 
 class Signer:
     def __init__(self, private_key: bytes) -> None:
@@ -57,9 +67,51 @@ class WiseClient:
         if data:
             body = json.dumps(data).encode("ascii")
         headers = headers.copy()
+        if CASSETTE is not None and CASSETTE.replaying:
+            recorded = CASSETTE.replay(method, url, body)
+            if recorded.status >= 400:
+                message = Message()
+                for name, value in recorded.headers:
+                    message[name] = value
+                raise urllib.error.HTTPError(
+                    url,
+                    recorded.status,
+                    recorded.reason,
+                    message,
+                    io.BytesIO(recorded.body),
+                )
+            return json.loads(recorded.body)
+
         req = urllib.request.Request(url, headers=headers, method=method, data=body)
-        resp = urllib.request.urlopen(req)
-        return json.load(resp)
+        start = time.monotonic()
+        try:
+            resp = urllib.request.urlopen(req)
+        except urllib.error.HTTPError as e:
+            if CASSETTE is not None:
+                CASSETTE.record(
+                    method,
+                    url,
+                    body,
+                    e.code,
+                    e.reason,
+                    list(e.headers.items()),
+                    e.read(),
+                    time.monotonic() - start,
+                )
+            raise
+        response_body = resp.read()
+        if CASSETTE is not None:
+            CASSETTE.record(
+                method,
+                url,
+                body,
+                resp.status,
+                resp.reason,
+                list(resp.headers.items()),
+                response_body,
+                time.monotonic() - start,
+            )
+        return json.loads(response_body)
 
     def http_request(
         self,